@@ -3,7 +3,17 @@ from app.config import load_configurations, configure_logging
 from .views import webhook_blueprint
 from .utils.web_chat_utils import web_chat_blueprint  
 from .utils.prospection_Epoint import prospection_blueprint 
+from .utils.prospection_jobs import prospection_jobs_blueprint
 from .views import send_template_blueprint  
+from .utils.webhook_queue import init_webhook_queue
+from .utils.message_coalescer import init_message_coalescer
+from .utils.whatsapp_utils import reply_to_burst
+from .utils.graph_api import init_graph_client
+from .utils.metrics import init_metrics
+from .utils.tracing import tracing_blueprint
+from .services.llm_registry import DEFAULT_CHAT_MODELS, warm_up_chat_models
+from .services.tenants import get_tenant_models, load_tenants, warm_up_contexts
+from .services.prompt_builder import warm_up_tokenizer
 from flask_cors import CORS
 
 def create_app():
@@ -20,6 +30,27 @@ def create_app():
     app.register_blueprint(webhook_blueprint)
     app.register_blueprint(web_chat_blueprint, url_prefix="/api/chat")
     app.register_blueprint(prospection_blueprint)
+    app.register_blueprint(prospection_jobs_blueprint)
     app.register_blueprint(send_template_blueprint)
+    app.register_blueprint(tracing_blueprint)
+
+    # Shared keep-alive session for the WhatsApp Graph API
+    init_graph_client(app)
+
+    # Tenants (phone number -> persona, context, model) are loaded once
+    load_tenants()
+    # Remote contexts (Bizboost) are fetched now, off the request path
+    warm_up_contexts()
+
+    # Build the shared LLM clients before the first message arrives
+    warm_up_chat_models(sorted(set(DEFAULT_CHAT_MODELS) | set(get_tenant_models())))
+    warm_up_tokenizer()
+
+    # Start the background workers that process webhook events
+    init_webhook_queue(app)
+    init_message_coalescer(app, reply_to_burst)
+
+    # Prometheus /metrics (stage latencies plus the stats of the shared components)
+    init_metrics(app)
 
     return app
\ No newline at end of file
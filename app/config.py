@@ -1,7 +1,5 @@
-import sys
 import os
 from dotenv import load_dotenv
-import logging
 
 
 def load_configurations(app):
@@ -14,11 +12,24 @@ def load_configurations(app):
     app.config["VERSION"] = os.getenv("VERSION")
     app.config["PHONE_NUMBER_ID"] = os.getenv("PHONE_NUMBER_ID")
     app.config["VERIFY_TOKEN"] = os.getenv("VERIFY_TOKEN")
+    # Pool de conexiones keep-alive hacia graph.facebook.com
+    app.config["GRAPH_POOL_SIZE"] = int(os.getenv("GRAPH_POOL_SIZE", "10"))
+    app.config["GRAPH_TIMEOUT"] = float(os.getenv("GRAPH_TIMEOUT", "10"))
+    app.config["GRAPH_CONNECT_TIMEOUT"] = float(os.getenv("GRAPH_CONNECT_TIMEOUT", "3"))
+    # Envíos masivos de plantillas (/send-messages): mensajes por segundo por número emisor
+    app.config["BULK_SEND_RATE"] = float(os.getenv("BULK_SEND_RATE", "20"))
+    app.config["BULK_SEND_CONCURRENCY"] = int(os.getenv("BULK_SEND_CONCURRENCY", "8"))
+    app.config["BULK_SEND_MAX_RETRIES"] = int(os.getenv("BULK_SEND_MAX_RETRIES", "3"))
+    # "queue": responder 200 al instante y procesar en workers; "inline": procesar en la request
+    app.config["WEBHOOK_MODE"] = os.getenv("WEBHOOK_MODE", "queue")
+    app.config["WEBHOOK_WORKERS"] = int(os.getenv("WEBHOOK_WORKERS", "4"))
+    app.config["WEBHOOK_QUEUE_SIZE"] = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    # Mensajes seguidos de un mismo usuario dentro de esta ventana se responden juntos (0 = desactivado)
+    app.config["COALESCE_WINDOW_SECONDS"] = float(os.getenv("COALESCE_WINDOW_SECONDS", "2"))
+    app.config["COALESCE_MAX_WAIT_SECONDS"] = float(os.getenv("COALESCE_MAX_WAIT_SECONDS", "10"))
 
 
 def configure_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        stream=sys.stdout,
-    )
+    # JSON lines (LOG_FORMAT) a stdout desde un hilo aparte, nivel según LOG_LEVEL
+    from app.utils.log_utils import setup_logging
+    setup_logging()
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import namedtuple
+
+import faiss
+import numpy as np
+
+# Carpeta donde se guardan los índices por tenant y versión de contexto
+RETRIEVAL_INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", "retrieval_indexes")
+# Tamaño aproximado de cada fragmento de contexto (caracteres)
+RETRIEVAL_CHUNK_SIZE = int(os.getenv("RETRIEVAL_CHUNK_SIZE", "600"))
+
+HASHING_DIMENSIONS = 512
+
+# text: contexto a usar; version y chunk_ids lo identifican (chunk_ids None = contexto completo)
+RetrievedContext = namedtuple("RetrievedContext", ["text", "version", "chunk_ids"])
+
+
+def context_version(context):
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def hashing_embedding(texts, dimensions=HASHING_DIMENSIONS):
+    """
+    Offline embedding: hashes words and character trigrams into a fixed-size,
+    L2-normalized vector. Good enough to match product names, prices and
+    keywords in a catalog without calling an external API.
+    """
+    vectors = np.zeros((len(texts), dimensions), dtype="float32")
+    for row, text in enumerate(texts):
+        words = re.findall(r"\w+", _normalize(text))
+        features = words + [word[i:i + 3] for word in words if len(word) > 3 for i in range(len(word) - 2)]
+        for feature in features:
+            vectors[row, zlib.crc32(feature.encode("utf-8")) % dimensions] += 1.0
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def chunk_context(context, chunk_size=RETRIEVAL_CHUNK_SIZE):
+    """
+    Split the flattened context into chunks of whole lines of about chunk_size
+    characters. Consecutive chunks share their boundary line so a key and its
+    value are not separated.
+    """
+    lines = [line for line in context.split("\n") if line.strip()]
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) > chunk_size:
+            chunks.append("\n".join(current))
+            current = current[-1:]
+            size = len(current[0])
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class ContextRetriever:
+    """
+    Per-tenant vector index over the flattened context.
+
+    An index is built once per (tenant, context version), persisted to
+    RETRIEVAL_INDEX_DIR and reloaded from there after a restart. The embedding
+    function is pluggable; its name is part of the index file name so indexes
+    built with different embeddings never get mixed.
+    """
+
+    def __init__(self, embed_fn=hashing_embedding, embedding_name=f"hashing{HASHING_DIMENSIONS}",
+                 index_dir=RETRIEVAL_INDEX_DIR):
+        self.embed_fn = embed_fn
+        self.embedding_name = embedding_name
+        self.index_dir = index_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._stats = {
+            "queries": 0,
+            "retrieval_time_total": 0.0,
+            "retrieval_time_max": 0.0,
+            "builds": 0,
+            "build_time_total": 0.0,
+            "loads": 0,
+        }
+
+    def _paths(self, tenant, version):
+        base = os.path.join(self.index_dir, f"{tenant}-{self.embedding_name}-{version}")
+        return base + ".faiss", base + ".json"
+
+    def _load_or_build(self, tenant, context, version):
+        index_path, chunks_path = self._paths(tenant, version)
+        if os.path.exists(index_path) and os.path.exists(chunks_path):
+            with open(chunks_path, "r", encoding="utf-8") as file:
+                chunks = json.load(file)
+            index = faiss.read_index(index_path)
+            with self._lock:
+                self._stats["loads"] += 1
+            return index, chunks
+
+        started = time.monotonic()
+        chunks = chunk_context(context)
+        vectors = self.embed_fn(chunks)
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            faiss.write_index(index, index_path)
+            with open(chunks_path, "w", encoding="utf-8") as file:
+                json.dump(chunks, file, ensure_ascii=False)
+        except OSError as e:
+            logging.error(f"Could not persist retrieval index for {tenant}: {e}")
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats["builds"] += 1
+            self._stats["build_time_total"] += elapsed
+        logging.info(f"Built retrieval index for {tenant}: {len(chunks)} chunks in {elapsed:.3f}s")
+        return index, chunks
+
+    def get_index(self, tenant, context, version):
+        key = (tenant, version)
+        entry = self._indexes.get(key)
+        if entry is not None:
+            return entry
+
+        with self._build_lock:
+            entry = self._indexes.get(key)
+            if entry is None:
+                entry = self._load_or_build(tenant, context, version)
+                # Las versiones anteriores del contexto de este tenant ya no sirven
+                for old_key in [k for k in self._indexes if k[0] == tenant]:
+                    del self._indexes[old_key]
+                self._indexes[key] = entry
+        return entry
+
+    def retrieve(self, tenant, context, query, top_k):
+        """
+        Return the top_k context chunks most similar to query, in their
+        original order, joined as a single context string.
+        """
+        started = time.monotonic()
+        version = context_version(context)
+        index, chunks = self.get_index(tenant, context, version)
+        if len(chunks) <= top_k:
+            selected = RetrievedContext(context, version, None)
+        else:
+            _, ids = index.search(self.embed_fn([query]), top_k)
+            chunk_ids = tuple(sorted(int(i) for i in ids[0] if i >= 0))
+            selected = RetrievedContext("\n".join(chunks[i] for i in chunk_ids), version, chunk_ids)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["retrieval_time_total"] += elapsed
+            self._stats["retrieval_time_max"] = max(self._stats["retrieval_time_max"], elapsed)
+        return selected
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["retrieval_time_avg"] = stats["retrieval_time_total"] / (stats["queries"] or 1)
+        stats["indexes"] = len(self._indexes)
+        return stats
+
+
+_retriever = ContextRetriever()
+
+
+def set_embedding_function(embed_fn, embedding_name):
+    """
+    Swap the embedding used for new indexes (e.g. an API-backed one).
+
+    embed_fn takes a list of strings and returns a float32 array of shape
+    (len(texts), dimensions) with L2-normalized rows.
+    """
+    global _retriever
+    _retriever = ContextRetriever(embed_fn=embed_fn, embedding_name=embedding_name)
+
+
+def retrieve_context(tenant, context, query, top_k):
+    """
+    Return only the parts of the tenant context relevant to query, as a
+    RetrievedContext whose version and chunk ids identify the text.
+
+    With top_k <= 0 retrieval is disabled and the whole context is returned.
+    """
+    if top_k <= 0 or not context or not query:
+        return RetrievedContext(context, context_version(context) if context else None, None)
+    return _retriever.retrieve(tenant, context, query, top_k)
+
+
+def get_retrieval_stats():
+    return _retriever.stats()
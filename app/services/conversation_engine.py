@@ -0,0 +1,163 @@
+import logging
+from langchain.memory import ChatMessageHistory
+from langchain.schema import HumanMessage, AIMessage
+from app.services.context_retrieval import retrieve_context
+from app.services.prompt_builder import build_budgeted_prompt
+from app.utils.chat_store import CHAT_HISTORY_WINDOW, check_if_thread_exists, message_role, store_turn
+from app.utils.conversation_locks import conversation_lock
+from app.utils.log_utils import log_payload
+from app.utils.metrics import TURNS, observe_stage
+from app.utils.tracing import traced
+
+# Conversation engine shared by every tenant. Everything tenant-specific
+# (persona, context, model, budgets) comes from the Tenant object.
+
+# Create chat history
+def create_chat_history(tenant):
+    logging.debug("Creating new chat history.")
+    history = ChatMessageHistory()
+    history.add_message(HumanMessage(role="system", content=tenant.greeting))
+    return history
+
+# User messages at the end of the history (the ones this turn answers)
+def trailing_user_messages(chat_history):
+    messages = []
+    for message in reversed(chat_history.messages):
+        if message_role(message) != "user":
+            break
+        messages.append(message)
+    messages.reverse()
+    return messages
+
+# Build the prompt messages for the current turn
+def build_prompt_messages(tenant, chat_history):
+    # Contexto cacheado: archivo (se relee si cambia) o remoto (se revalida en segundo plano)
+    with observe_stage("context", tenant.name):
+        context = tenant.get_context()
+
+    if context is None:
+        logging.error(f"No context available for tenant {tenant.name}.")
+        return None
+
+    # Solo los fragmentos del contexto relevantes para los mensajes nuevos del usuario
+    query = "\n".join(message.content for message in trailing_user_messages(chat_history))
+    with observe_stage("retrieval", tenant.name):
+        retrieved = retrieve_context(tenant.name, context, query, tenant.retrieval_top_k)
+
+    # Armar el prompt dentro del presupuesto de tokens del tenant
+    with observe_stage("prompt", tenant.name):
+        prompt_messages, token_report = build_budgeted_prompt(
+            tenant.system_prompt, retrieved.text, chat_history.messages[-CHAT_HISTORY_WINDOW:], tenant.prompt_token_budget,
+            model=tenant.model,
+            tenant=tenant.name,
+            context_key=(retrieved.version, retrieved.chunk_ids),
+        )
+    logging.info(f"Prompt tokens for {tenant.name}: {token_report['total']}", extra={"tenant": tenant.name, "prompt_tokens": token_report})
+    return prompt_messages
+
+# Main function to handle chat
+@traced()
+def run_chat(tenant, chat_history):
+    """
+    Generate the assistant reply for an already loaded chat history.
+
+    The history is only read here; persisting the turn is left to
+    generate_response so the whole turn is written in a single transaction.
+    """
+    prompt_messages = build_prompt_messages(tenant, chat_history)
+    if prompt_messages is None:
+        return
+
+    # Generate the response using the chat model
+    with observe_stage("llm", tenant.name):
+        response = tenant.get_chat_model().invoke(prompt_messages)
+    new_message = response.content if isinstance(response.content, str) else str(response.content)
+    log_payload("Generated response", new_message, tenant=tenant.name)
+
+    return new_message
+
+# Load the thread and add the incoming user message(s) (in memory only)
+def start_turn(tenant, message_body, wa_id, name):
+    """
+    message_body can be a single message or a list of messages sent in a
+    burst; each one is added to the history as its own user message.
+    """
+    log_payload(f"Generating response for wa_id {wa_id}", message_body, wa_id=wa_id, tenant=tenant.name)
+
+    message_bodies = message_body if isinstance(message_body, list) else [message_body]
+
+    # Fetch existing chat history or create new one
+    with observe_stage("db_load", tenant.name):
+        chat_history = check_if_thread_exists(wa_id)
+    if chat_history is None:
+        logging.info(f"Creating new {tenant.name} thread for {name} with wa_id {wa_id}")
+        chat_history = create_chat_history(tenant)
+    else:
+        logging.info(f"Retrieving existing {tenant.name} thread for {name} with wa_id {wa_id}")
+
+    # Add user messages to the in-memory history; nothing is written until the turn completes
+    user_messages = []
+    for body in message_bodies:
+        if not isinstance(body, str):
+            body = str(body)
+        user_message = HumanMessage(role="user", content=body)
+        chat_history.add_message(user_message)
+        user_messages.append(user_message)
+    return chat_history, user_messages
+
+# Persist the user and assistant messages together
+def finish_turn(tenant, wa_id, chat_history, user_messages, new_message):
+    ai_message = AIMessage(role="assistant", content=new_message)
+    chat_history.add_message(ai_message)
+    with observe_stage("db_store", tenant.name):
+        store_turn(wa_id, chat_history, user_messages + [ai_message])
+    TURNS.inc(tenant=tenant.name)
+
+# Main function to generate response
+@traced()
+def generate_response(tenant, message_body, wa_id, name):
+    """
+    Answer one user message, or a burst of them given as a list. Turns of the same wa_id are serialized (in
+    arrival order) from loading the thread until the turn is stored, so
+    concurrent messages can't overwrite each other's history.
+    """
+    with conversation_lock(wa_id):
+        chat_history, user_messages = start_turn(tenant, message_body, wa_id, name)
+
+        # Run chat logic to get AI response
+        new_message = run_chat(tenant, chat_history)
+        if new_message is None:
+            return None
+
+        finish_turn(tenant, wa_id, chat_history, user_messages, new_message)
+        return new_message
+
+# Streaming variant of generate_response
+def stream_response(tenant, message_body, wa_id, name):
+    """
+    Yield the assistant reply chunk by chunk as the model produces it.
+
+    The turn is persisted once the last chunk has been generated, exactly as
+    generate_response would have stored it. Nothing is stored if the stream
+    fails or the client goes away before it finishes. The conversation lock
+    is held until the stream ends or is closed.
+    """
+    with conversation_lock(wa_id):
+        chat_history, user_messages = start_turn(tenant, message_body, wa_id, name)
+
+        prompt_messages = build_prompt_messages(tenant, chat_history)
+        if prompt_messages is None:
+            return
+
+        chunks = []
+        # Incluye el tiempo que tarda el cliente en consumir cada fragmento
+        with observe_stage("llm", tenant.name):
+            for chunk in tenant.get_chat_model().stream(prompt_messages):
+                text = chunk.content if isinstance(chunk.content, str) else str(chunk.content)
+                if text:
+                    chunks.append(text)
+                    yield text
+
+        new_message = "".join(chunks)
+        log_payload("Generated response", new_message, tenant=tenant.name)
+        finish_turn(tenant, wa_id, chat_history, user_messages, new_message)
@@ -0,0 +1,83 @@
+import logging
+import os
+import threading
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+# Conexiones keep-alive compartidas por todos los clientes de OpenAI
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+# Modelos que se crean al arrancar la app: (modelo, temperatura)
+DEFAULT_CHAT_MODELS = [
+    ("gpt-4o", 0.2),  # Conversaciones de WhatsApp y web chat
+    ("gpt-4", 0.7),  # Términos de búsqueda de /prospectar
+]
+
+_clients = {}
+_lock = threading.Lock()
+_http_client = None
+
+
+def _get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+            timeout=LLM_TIMEOUT,
+        )
+    return _http_client
+
+
+def get_chat_model(model="gpt-4o", temperature=0.2, **kwargs):
+    """
+    Return the shared ChatOpenAI client for this configuration, creating it once.
+
+    All clients share one httpx connection pool, so TLS sessions to the OpenAI
+    API are reused across messages and requests.
+
+    Args:
+        model (str): OpenAI model name.
+        temperature (float): Sampling temperature.
+        **kwargs: Extra ChatOpenAI options; they are part of the cache key.
+
+    Returns:
+        ChatOpenAI: The cached client.
+    """
+    key = (model, temperature, tuple(sorted(kwargs.items())))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            logging.info(f"Initializing chat model {model} (temperature={temperature}).")
+            client = ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=_get_http_client(),
+                **kwargs,
+            )
+            _clients[key] = client
+    return client
+
+
+def warm_up_chat_models(models=DEFAULT_CHAT_MODELS):
+    """
+    Build the configured clients at startup so the first message doesn't pay for it.
+
+    A client that can't be built (e.g. OPENAI_API_KEY unset) is only logged; it
+    is created on first use instead, so the rest of the app still boots.
+    """
+    for model, temperature in models:
+        try:
+            get_chat_model(model, temperature)
+        except Exception as e:
+            logging.error(f"Could not initialize chat model {model} at startup: {e}")
@@ -0,0 +1,237 @@
+import copy
+import functools
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import tiktoken
+from langchain.schema import SystemMessage
+
+# Tokens extra que agrega la API por cada mensaje (rol y separadores)
+TOKENS_PER_MESSAGE = 4
+
+# Mensajes de contexto compilados (por versión de contexto y fragmentos elegidos) que se mantienen en memoria
+PROMPT_PREFIX_CACHE_SIZE = int(os.getenv("PROMPT_PREFIX_CACHE_SIZE", "256"))
+
+PromptPart = namedtuple("PromptPart", ["message", "tokens"])
+
+
+# Caracteres por token cuando no se puede cargar tiktoken (estimación)
+APPROXIMATE_CHARS_PER_TOKEN = 4
+
+
+class ApproximateEncoding:
+    """
+    Stand-in for a tiktoken encoding when the BPE file can't be loaded: one
+    "token" every APPROXIMATE_CHARS_PER_TOKEN characters. Budgets become
+    rough, but counting tokens never blocks a reply.
+    """
+
+    name = "approximate"
+
+    def encode(self, text):
+        step = APPROXIMATE_CHARS_PER_TOKEN
+        return [text[i:i + step] for i in range(0, len(text), step)]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    tiktoken encoding for model. If it can't be loaded (the first load
+    downloads the BPE file) the approximate counter is cached instead, so
+    the reply path never retries the download.
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning(f"Could not load the tokenizer for {model}, counting tokens approximately: {e}")
+        return ApproximateEncoding()
+
+
+def warm_up_tokenizer(models=("gpt-4o",)):
+    """
+    Load the tiktoken encodings at startup (the first load downloads the BPE file).
+    """
+    for model in models:
+        get_encoding(model)
+
+
+def count_tokens(text, model="gpt-4o"):
+    return len(get_encoding(model).encode(text or ""))
+
+
+def count_message_tokens(message, model="gpt-4o"):
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return count_tokens(content, model) + TOKENS_PER_MESSAGE
+
+
+def truncate_to_tokens(text, max_tokens, model="gpt-4o"):
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max(0, max_tokens)])
+
+
+class PromptPartCache:
+    """
+    LRU cache of compiled prompt messages and their token counts.
+
+    Two instances are used: one for the system message, keyed on
+    (tenant, model, persona hash), and one for the context message, keyed
+    on (tenant, model, context version, retrieved chunk ids). A new persona
+    or context version gets its own entries and the old ones age out.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, key, build):
+        with self._lock:
+            part = self._entries.get(key)
+            if part is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return part
+            self._stats["misses"] += 1
+
+        part = build()
+        with self._lock:
+            self._entries[key] = part
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return part
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        stats["hit_rate"] = stats["hits"] / ((stats["hits"] + stats["misses"]) or 1)
+        return stats
+
+
+_system_cache = PromptPartCache(max_entries=32)
+_context_cache = PromptPartCache(max_entries=PROMPT_PREFIX_CACHE_SIZE)
+
+
+def _text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _compile_part(content, model):
+    message = SystemMessage(content=content)
+    return PromptPart(message, count_message_tokens(message, model))
+
+
+def get_prompt_cache_stats():
+    stats = {}
+    for name, cache in (("system", _system_cache), ("context", _context_cache)):
+        for key, value in cache.stats().items():
+            stats[f"{name}_{key}"] = value
+    return stats
+
+
+def build_budgeted_prompt(system_prompt, context, history_messages, token_budget, model="gpt-4o", tenant=None,
+                          context_key=None):
+    """
+    Assemble the prompt messages for one turn within a token budget.
+
+    The system prompt always goes first. The context comes next and is
+    truncated if needed so that at least the latest message still fits; the
+    remaining budget is then filled with as many recent messages as possible,
+    newest first. A latest message that alone exceeds the budget is
+    truncated; a budget too small for the system prompt raises ValueError. The system and context messages come precompiled from
+    their caches, so usually only the history is tokenized per turn.
+
+    Args:
+        system_prompt (str): Persona/instructions for the tenant.
+        context (str): Flattened tenant context (may be None).
+        history_messages (list): Conversation messages, oldest first.
+        token_budget (int): Maximum prompt size in tokens.
+        model (str): Model whose tokenizer is used for counting.
+        tenant (str): Tenant name, used to key the caches.
+        context_key (tuple): Identifies the context text, e.g. (context
+            version, retrieved chunk ids). Without it the text is hashed.
+
+    Returns:
+        tuple: (messages, report) where report has the token count of each
+        part of the prompt and the total.
+    """
+    system = _system_cache.get(
+        (tenant, model, _text_hash(system_prompt)),
+        lambda: _compile_part(system_prompt, model),
+    )
+    system_tokens = system.tokens
+    remaining = token_budget - system_tokens
+
+    latest_tokens = count_message_tokens(history_messages[-1], model) if history_messages else 0
+    if latest_tokens > remaining:
+        # El último mensaje solo ya no entra: se recorta para respetar el presupuesto
+        max_tokens = remaining - TOKENS_PER_MESSAGE
+        if max_tokens <= 0:
+            raise ValueError(
+                f"Prompt budget of {token_budget} tokens leaves no room for a message "
+                f"after the system prompt ({system_tokens} tokens)."
+            )
+        logging.warning(
+            f"Latest message truncated from {latest_tokens} to {max_tokens} tokens to fit the prompt budget of {token_budget}."
+        )
+        latest = copy.copy(history_messages[-1])
+        latest.content = truncate_to_tokens(latest.content, max_tokens, model)
+        history_messages = list(history_messages[:-1]) + [latest]
+        latest_tokens = count_message_tokens(latest, model)
+
+    messages = [system.message]
+    context_tokens = 0
+    if context:
+        context_part = _context_cache.get(
+            (tenant, model, context_key if context_key is not None else _text_hash(context)),
+            lambda: _compile_part(f"Contexto:\n{context}", model),
+        )
+        context_message = context_part.message
+        context_tokens = context_part.tokens
+        available = max(0, remaining - latest_tokens - TOKENS_PER_MESSAGE)
+        if context_tokens - TOKENS_PER_MESSAGE > available:
+            # Caso raro (mensaje muy largo): se recorta una copia, el mensaje cacheado queda intacto
+            if available:
+                logging.warning(f"Context truncated to {available} tokens to fit the prompt budget of {token_budget}.")
+            else:
+                logging.warning(f"Context dropped: the latest message fills the prompt budget of {token_budget}.")
+            context_text = truncate_to_tokens(context_message.content, available, model)
+            context_message = SystemMessage(content=context_text) if context_text else None
+            context_tokens = count_message_tokens(context_message, model) if context_message else 0
+        if context_message is not None:
+            messages.append(context_message)
+            remaining -= context_tokens
+
+    history = []
+    history_tokens = 0
+    for message in reversed(history_messages):
+        tokens = count_message_tokens(message, model)
+        # El último mensaje entra siempre (ya se recortó si hacía falta)
+        if history and history_tokens + tokens > remaining:
+            break
+        history.append(message)
+        history_tokens += tokens
+    history.reverse()
+    messages.extend(history)
+
+    report = {
+        "budget": token_budget,
+        "system": system_tokens,
+        "context": context_tokens,
+        "history": history_tokens,
+        "history_messages": len(history),
+        "total": system_tokens + context_tokens + history_tokens,
+    }
+    return messages, report
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import threading
+
+from app.services.llm_registry import get_chat_model
+from app.utils.context_store import get_file_context, get_remote_context
+
+# Archivo con la configuración de cada tenant (número de WhatsApp, persona, contexto, modelo)
+TENANTS_CONFIG_PATH = os.getenv("TENANTS_CONFIG_PATH", os.path.join("app", "contexts", "tenants.json"))
+
+
+def _flatten_json(data, include_keys):
+    texts = []
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if include_keys:
+                # La clave le da contexto al valor
+                texts.append(str(key))
+            texts.extend(_flatten_json(value, include_keys))
+    elif isinstance(data, list):
+        for item in data:
+            texts.extend(_flatten_json(item, include_keys))
+    elif include_keys:
+        # Cualquier otro tipo (int, float, bool, etc.) se incluye como texto
+        texts.append(str(data))
+    elif isinstance(data, str):
+        texts.append(data)
+    return texts
+
+
+def _process_json_data(json_data, include_keys):
+    if json_data is None:
+        logging.warning("No JSON data available to process.")
+        return None
+
+    try:
+        texts = _flatten_json(json_data, include_keys)
+        concatenated_text = "\n".join([text for text in texts if text.strip()])
+
+        if not concatenated_text:
+            logging.warning("No valid text data found in the JSON.")
+            return None
+
+        logging.info(f"Context size: {len(concatenated_text)} characters")
+        return concatenated_text
+    except Exception as e:
+        logging.error(f"Error processing JSON data: {e}")
+        return None
+
+
+# Process JSON data keeping the keys and every scalar value (catálogos con precios)
+def process_json_keys_and_values(json_data):
+    return _process_json_data(json_data, include_keys=True)
+
+
+# Process JSON data keeping only the text values (formularios)
+def process_json_text_values(json_data):
+    return _process_json_data(json_data, include_keys=False)
+
+
+CONTEXT_FORMATS = {
+    "keys_and_values": process_json_keys_and_values,
+    "text_values": process_json_text_values,
+}
+
+
+class Tenant:
+    """
+    One business served by the bot: its persona, context source, model and
+    prompt budgets. Built once when the registry is loaded.
+
+    The token budget and retrieval top-k can be overridden per tenant with
+    <NAME>_PROMPT_TOKEN_BUDGET and <NAME>_RETRIEVAL_TOP_K.
+    """
+
+    def __init__(self, name, config, base_dir):
+        self.name = name
+        self.phone_numbers = [str(number) for number in config.get("phone_numbers", [])]
+        self.greeting = config["greeting"]
+
+        with open(os.path.join(base_dir, config["persona_file"]), "r", encoding="utf-8") as file:
+            self.system_prompt = file.read().strip()
+
+        context = config["context"]
+        self.context_type = context["type"]
+        if self.context_type == "file":
+            self.context_source = os.path.join(base_dir, context["path"])
+        elif self.context_type == "remote":
+            self.context_source = context["url"]
+        else:
+            raise ValueError(f"Unknown context type for tenant {name}: {self.context_type}")
+        try:
+            self.context_processor = CONTEXT_FORMATS[context.get("format", "keys_and_values")]
+        except KeyError:
+            raise ValueError(f"Unknown context format for tenant {name}: {context.get('format')}")
+
+        self.model = config.get("model", "gpt-4o")
+        self.temperature = float(config.get("temperature", 0.2))
+        env_prefix = name.upper()
+        self.prompt_token_budget = int(os.getenv(f"{env_prefix}_PROMPT_TOKEN_BUDGET", config.get("prompt_token_budget", 6000)))
+        self.retrieval_top_k = int(os.getenv(f"{env_prefix}_RETRIEVAL_TOP_K", config.get("retrieval_top_k", 4)))
+
+    def get_context(self):
+        """
+        Flattened context from the shared context cache (file or remote).
+        """
+        if self.context_type == "file":
+            return get_file_context(self.context_source, self.context_processor)
+        return get_remote_context(self.context_source, self.context_processor)
+
+    def get_chat_model(self):
+        return get_chat_model(self.model, temperature=self.temperature)
+
+    def __repr__(self):
+        return f"Tenant({self.name!r})"
+
+
+class TenantRegistry:
+    """
+    Tenants by name and by WhatsApp display phone number, both plain dicts so
+    routing a message is a single lookup.
+    """
+
+    def __init__(self, tenants):
+        self.tenants = {tenant.name: tenant for tenant in tenants}
+        self.by_phone = {}
+        for tenant in tenants:
+            for phone_number in tenant.phone_numbers:
+                if phone_number in self.by_phone:
+                    raise ValueError(
+                        f"Phone number {phone_number} is assigned to both "
+                        f"{self.by_phone[phone_number].name} and {tenant.name}"
+                    )
+                self.by_phone[phone_number] = tenant
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8") as file:
+            config = json.load(file)
+        base_dir = os.path.dirname(os.path.abspath(path))
+        return cls([Tenant(name, tenant_config, base_dir) for name, tenant_config in config.items()])
+
+
+_registry = None
+_lock = threading.Lock()
+
+
+def load_tenants(path=TENANTS_CONFIG_PATH):
+    """
+    Load (or reload) the tenant registry from the config file.
+    """
+    global _registry
+    registry = TenantRegistry.from_file(path)
+    _registry = registry
+    logging.info(f"Loaded {len(registry.tenants)} tenants from {path}: {', '.join(registry.tenants)}")
+    return registry
+
+
+def get_registry():
+    # Normalmente ya lo cargó create_app; esto cubre scripts sueltos
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                load_tenants()
+    return _registry
+
+
+def get_tenant(name):
+    return get_registry().tenants.get(name)
+
+
+def get_tenant_for_phone(phone_number):
+    return get_registry().by_phone.get(phone_number)
+
+
+def get_tenant_models():
+    """
+    (model, temperature) pairs used by the tenants, for warming up the clients.
+    """
+    return sorted({(tenant.model, tenant.temperature) for tenant in get_registry().tenants.values()})
+
+
+def warm_up_contexts():
+    """
+    Load every tenant's context in a background thread, so the first message
+    of a remote-context tenant doesn't wait on the origin.
+    """
+    def warm_up():
+        for tenant in get_registry().tenants.values():
+            if tenant.get_context() is None:
+                logging.warning(f"Could not load the context of tenant {tenant.name} at startup")
+
+    threading.Thread(target=warm_up, name="context-warm-up", daemon=True).start()
@@ -0,0 +1,169 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from .graph_api import get_graph_client
+from .whatsapp_utils import get_template_message_input
+
+# Espera máxima entre reintentos ante 429/5xx
+MAX_BACKOFF = 30.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_rate_limiter(phone_number_id, rate):
+    """
+    Return the token bucket shared by every bulk send from phone_number_id.
+    """
+    with _buckets_lock:
+        bucket = _buckets.get(phone_number_id)
+        if bucket is None or bucket.rate != rate:
+            bucket = TokenBucket(rate)
+            _buckets[phone_number_id] = bucket
+        return bucket
+
+
+def _backoff_delay(attempt, response=None):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_BACKOFF)
+        except ValueError:
+            pass
+    return min(MAX_BACKOFF, (2 ** attempt) + random.uniform(0, 1))
+
+
+def _is_connect_error(error):
+    """
+    True if the request never reached Graph API (DNS failure, connection
+    refused, connect timeout), so sending it again can't duplicate the message.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError):
+        return False
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _sent_message_id(response):
+    try:
+        messages = response.json().get("messages") or [{}]
+        return messages[0].get("id")
+    except (ValueError, AttributeError, IndexError, TypeError):
+        # Body inesperado: el mensaje se aceptó igual (2xx), solo falta el id
+        logging.warning(f"Unexpected Graph API response body: {response.text[:200]}")
+        return None
+
+
+def _send_one(client, bucket, recipient, payload, phone_number_id, max_retries):
+    """
+    Send one template. Only 429/5xx responses and connection errors are
+    retried; after a read timeout the message may already have been
+    delivered, so it is reported as "unknown" instead of being sent again.
+    """
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            response = client.post_message(
+                json=payload, endpoint="bulk_template", phone_number_id=phone_number_id
+            )
+        except requests.HTTPError as e:
+            status = e.response.status_code
+            retryable = status == 429 or status >= 500
+            if retryable and attempt < max_retries:
+                time.sleep(_backoff_delay(attempt, e.response))
+                continue
+            return {"recipient": recipient, "status": "failed", "http_status": status, "error": e.response.text}
+        except requests.RequestException as e:
+            if _is_connect_error(e):
+                if attempt < max_retries:
+                    time.sleep(_backoff_delay(attempt))
+                    continue
+                return {"recipient": recipient, "status": "failed", "error": str(e)}
+            # Timeout de lectura o conexión cortada: no se sabe si el mensaje llegó
+            logging.warning(f"Template send to {recipient} may or may not have been delivered: {e}")
+            return {"recipient": recipient, "status": "unknown", "error": str(e)}
+
+        return {"recipient": recipient, "status": "sent", "message_id": _sent_message_id(response)}
+
+
+def send_template_bulk(recipients, template_name, language_code="es", components=None,
+                       phone_number_id=None, rate=20, concurrency=8, max_retries=3):
+    """
+    Send a template message to many recipients concurrently.
+
+    Sends are capped by a token bucket per sender phone number id, and 429 or
+    5xx responses and connection errors are retried with exponential backoff
+    (honouring Retry-After). Read timeouts are not retried and come back
+    with status "unknown".
+
+    Args:
+        recipients (list): WhatsApp ids of the recipients.
+        template_name (str): The name of the approved WhatsApp template.
+        language_code (str): The language code of the template.
+        components (list): Components for the template placeholders.
+        phone_number_id (str): Sender; defaults to the configured PHONE_NUMBER_ID.
+        rate (float): Maximum messages per second for this sender.
+        concurrency (int): Number of sends in flight at once.
+        max_retries (int): Retries per recipient for retryable failures.
+
+    Returns:
+        list: One {"recipient", "status", ...} dict per recipient, in input
+        order; status is "sent", "failed" or "unknown".
+    """
+    client = get_graph_client()
+    phone_number_id = phone_number_id or client.phone_number_id
+    bucket = get_rate_limiter(phone_number_id, rate)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk-send") as executor:
+        results = list(executor.map(
+            lambda recipient: _send_one(
+                client,
+                bucket,
+                recipient,
+                get_template_message_input(recipient, template_name, language_code, components),
+                phone_number_id,
+                max_retries,
+            ),
+            recipients,
+        ))
+
+    sent = sum(1 for result in results if result["status"] == "sent")
+    logging.info(
+        f"Bulk send of '{template_name}': {sent}/{len(results)} sent in {time.monotonic() - started:.1f}s"
+    )
+    return results
@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+import threading
+
+from psycopg2.extras import execute_values
+from langchain.memory import ChatMessageHistory
+from langchain.schema import HumanMessage, AIMessage
+
+from app.utils.db_utils import get_db_connection
+
+# "blob": una fila por conversación en chat_history (formato original)
+# "messages": una fila por mensaje en chat_messages, indexada por (wa_id, seq)
+CHAT_STORAGE_BACKEND = os.getenv("CHAT_STORAGE_BACKEND", "blob")
+
+# Máximo de mensajes recientes que se cargan por turno; el prompt_builder
+# después usa tantos como entren en el presupuesto de tokens del tenant
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+
+CREATE_MESSAGES_TABLE = """
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        wa_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (wa_id, seq)
+    )
+"""
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def message_role(message):
+    role = getattr(message, "role", None)
+    if role:
+        return role
+    return "assistant" if isinstance(message, AIMessage) else "user"
+
+
+# Serialize chat history to JSON
+def serialize_chat_history(chat_history):
+    return json.dumps([{"role": message_role(m), "content": m.content} for m in chat_history.messages])
+
+
+# Deserialize chat history from JSON
+def deserialize_chat_history(serialized_data):
+    if isinstance(serialized_data, list):
+        messages = serialized_data  # Si ya es lista, úsala directamente
+    elif isinstance(serialized_data, str):
+        messages = json.loads(serialized_data)  # Deserializar si es un JSON string
+    else:
+        raise ValueError("Invalid data type for serialized_data")
+
+    chat_history = ChatMessageHistory()
+    for msg in messages:
+        if msg["role"] == "user":
+            chat_history.add_message(HumanMessage(role=msg["role"], content=msg["content"]))
+        elif msg["role"] == "assistant":
+            chat_history.add_message(AIMessage(role=msg["role"], content=msg["content"]))
+    return chat_history
+
+
+def ensure_schema():
+    """
+    Create the chat_messages table used by the "messages" backend if needed.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(CREATE_MESSAGES_TABLE)
+        _schema_ready = True
+
+
+class BlobChatStore:
+    """
+    Original layout: the whole history is a JSON blob in chat_history.history.
+    """
+
+    def load_history(self, wa_id, limit=None):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT history FROM chat_history WHERE wa_id = %s", (wa_id,))
+                result = cursor.fetchone()
+
+        if not result or result[0] is None:
+            return None
+        messages = result[0]
+        if isinstance(messages, str):
+            messages = json.loads(messages)
+        # El blob se reescribe completo, así que siempre se carga entero
+        return messages
+
+    def save_turn(self, wa_id, chat_history, new_messages):
+        serialized_data = serialize_chat_history(chat_history)  # JSON serializado
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO chat_history (wa_id, history)
+                    VALUES (%s, %s)
+                    ON CONFLICT (wa_id) DO UPDATE SET history = EXCLUDED.history
+                    """,
+                    (wa_id, serialized_data),
+                )
+
+    def delete_thread(self, wa_id):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM chat_history WHERE wa_id = %s", (wa_id,))
+
+    def delete_all(self):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM chat_history")
+                return cursor.rowcount
+
+
+class MessageChatStore:
+    """
+    Append-only layout: one row per message in chat_messages.
+
+    Appends only insert the new rows, and reads fetch just the last `limit`
+    messages through the (wa_id, seq) primary key index.
+    """
+
+    def load_history(self, wa_id, limit=None):
+        ensure_schema()
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                if limit:
+                    cursor.execute(
+                        """
+                        SELECT role, content FROM (
+                            SELECT seq, role, content FROM chat_messages
+                            WHERE wa_id = %s ORDER BY seq DESC LIMIT %s
+                        ) recent ORDER BY seq
+                        """,
+                        (wa_id, limit),
+                    )
+                else:
+                    cursor.execute(
+                        "SELECT role, content FROM chat_messages WHERE wa_id = %s ORDER BY seq",
+                        (wa_id,),
+                    )
+                rows = cursor.fetchall()
+
+        if not rows:
+            return None
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def save_turn(self, wa_id, chat_history, new_messages):
+        if not new_messages:
+            return
+        ensure_schema()
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                # El advisory lock serializa los appends de una misma conversación
+                # para que dos turnos concurrentes no choquen en el mismo seq
+                cursor.execute(
+                    """
+                    SELECT pg_advisory_xact_lock(hashtext(%s)),
+                           COALESCE((SELECT MAX(seq) FROM chat_messages WHERE wa_id = %s), 0)
+                    """,
+                    (wa_id, wa_id),
+                )
+                last_seq = cursor.fetchone()[1]
+                rows = [
+                    (wa_id, last_seq + offset, message_role(m), m.content)
+                    for offset, m in enumerate(new_messages, start=1)
+                ]
+                execute_values(
+                    cursor,
+                    "INSERT INTO chat_messages (wa_id, seq, role, content) VALUES %s",
+                    rows,
+                )
+
+    def delete_thread(self, wa_id):
+        ensure_schema()
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM chat_messages WHERE wa_id = %s", (wa_id,))
+
+    def delete_all(self):
+        ensure_schema()
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM chat_messages")
+                return cursor.rowcount
+
+
+_BACKENDS = {
+    "blob": BlobChatStore,
+    "messages": MessageChatStore,
+}
+
+
+def _create_store(backend):
+    try:
+        return _BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Unknown CHAT_STORAGE_BACKEND: {backend}")
+
+
+_store = _create_store(CHAT_STORAGE_BACKEND)
+
+
+# Check if chat thread exists in PostgreSQL
+def check_if_thread_exists(wa_id, limit=CHAT_HISTORY_WINDOW):
+    """
+    Load the chat history for wa_id, or None if there is no thread yet.
+
+    With the "messages" backend only the last `limit` messages are fetched.
+    """
+    messages = _store.load_history(wa_id, limit=limit)
+    if messages is None:
+        logging.info(f"No thread found for wa_id: {wa_id}")
+        return None
+    return deserialize_chat_history(messages)
+
+
+# Store chat thread in PostgreSQL
+def store_turn(wa_id, chat_history, new_messages):
+    """
+    Persist the messages of one turn in a single transaction.
+
+    Args:
+        wa_id (str): Conversation id.
+        chat_history (ChatMessageHistory): History including the new messages.
+        new_messages (list): Messages added during this turn.
+    """
+    _store.save_turn(wa_id, chat_history, new_messages)
+
+
+def get_history(wa_id):
+    """
+    Return the full history of wa_id as a list of {"role", "content"} dicts.
+    """
+    return _store.load_history(wa_id) or []
+
+
+def delete_thread(wa_id):
+    _store.delete_thread(wa_id)
+
+
+def delete_all_threads():
+    """
+    Delete every conversation from both layouts (chat_history and
+    chat_messages), so nothing is left behind after switching
+    CHAT_STORAGE_BACKEND or a partial migration.
+
+    Returns:
+        dict: Rows deleted per backend.
+    """
+    return {backend: store_class().delete_all() for backend, store_class in _BACKENDS.items()}
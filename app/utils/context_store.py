@@ -0,0 +1,263 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+# Segundos que una copia remota se considera fresca antes de revalidarla
+REMOTE_CONTEXT_TTL = float(os.getenv("REMOTE_CONTEXT_TTL", "300"))
+REMOTE_CONTEXT_TIMEOUT = float(os.getenv("REMOTE_CONTEXT_TIMEOUT", "10"))
+# Tras un error, esperar esto antes de volver a intentar contra el origen
+REMOTE_CONTEXT_RETRY_AFTER = float(os.getenv("REMOTE_CONTEXT_RETRY_AFTER", "30"))
+
+
+class ContextStore:
+    """
+    In-process cache of flattened tenant contexts.
+
+    Each entry is keyed on the source and the function used to flatten it, so
+    the same JSON can be served to tenants that process it differently. Local
+    files are only re-read when their mtime/size change, and only re-flattened
+    when the content hash actually differs. Remote contexts are kept for a TTL,
+    then revalidated in the background with conditional requests while the
+    last good copy keeps being served.
+    """
+
+    def __init__(self, ttl=REMOTE_CONTEXT_TTL, timeout=REMOTE_CONTEXT_TIMEOUT,
+                 retry_after=REMOTE_CONTEXT_RETRY_AFTER):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._entries = {}
+        # Primer fetch de cada url: un lock por clave y, si falló, cuándo reintentar
+        self._fetch_locks = {}
+        self._retry_at = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "rebuilds": 0,
+            "rebuild_time_total": 0.0,
+            "rebuild_time_last": 0.0,
+            "errors": 0,
+            "stale_hits": 0,
+            "not_modified": 0,
+            "background_refreshes": 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _build(self, data, processor):
+        started = time.monotonic()
+        context = processor(data)
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats["rebuilds"] += 1
+            self._stats["rebuild_time_total"] += elapsed
+            self._stats["rebuild_time_last"] = elapsed
+        return context
+
+    def get_file_context(self, file_path, processor):
+        """
+        Return the flattened context for a local JSON file.
+
+        Args:
+            file_path (str): Path to the JSON file.
+            processor (callable): Turns the parsed JSON into the context string.
+
+        Returns:
+            str: The context, or None if the file could never be loaded.
+        """
+        key = ("file", os.path.abspath(file_path), processor)
+        entry = self._entries.get(key)
+
+        try:
+            stat = os.stat(file_path)
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                self._count("hits")
+                return entry["context"]
+
+            with open(file_path, "rb") as file:
+                raw = file.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            if entry and entry["digest"] == digest:
+                # El archivo se tocó pero el contenido es el mismo
+                entry["mtime_ns"] = stat.st_mtime_ns
+                entry["size"] = stat.st_size
+                self._count("hits")
+                return entry["context"]
+
+            self._count("misses")
+            context = self._build(json.loads(raw.decode("utf-8")), processor)
+        except (OSError, ValueError) as e:
+            self._count("errors")
+            logging.error(f"Error loading context file {file_path}: {e}")
+            # Si ya teníamos una versión buena, seguimos sirviéndola
+            return entry["context"] if entry else None
+
+        self._entries[key] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "digest": digest,
+            "context": context,
+        }
+        logging.info(f"Context for {file_path} rebuilt ({len(context or '')} characters)")
+        return context
+
+    def _fetch_remote(self, key, url, processor):
+        """
+        Fetch url, sending the validators of the cached copy if there is one.
+
+        Returns the (possibly unchanged) entry, or the previous entry if the
+        origin failed.
+        """
+        entry = self._entries.get(key)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = self._session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and entry:
+                self._count("not_modified")
+                entry["expires_at"] = time.monotonic() + self.ttl
+                return entry
+
+            response.raise_for_status()
+            digest = hashlib.sha256(response.content).hexdigest()
+            if entry and entry["digest"] == digest:
+                context = entry["context"]
+            else:
+                data = response.json()
+                if not data:
+                    raise ValueError("No JSON data found at the endpoint.")
+                self._count("misses")
+                context = self._build(data, processor)
+                if context is None:
+                    raise ValueError("No valid text data found in the JSON.")
+        except (requests.RequestException, ValueError) as e:
+            self._count("errors")
+            logging.error(f"Error fetching context from {url}: {e}")
+            if entry:
+                # Seguir sirviendo la última copia buena y reintentar más tarde
+                entry["expires_at"] = time.monotonic() + self.retry_after
+            return entry
+
+        new_entry = {
+            "digest": digest,
+            "context": context,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "expires_at": time.monotonic() + self.ttl,
+            "refreshing": False,
+        }
+        self._entries[key] = new_entry
+        return new_entry
+
+    def _refresh_in_background(self, key, url, processor):
+        try:
+            self._fetch_remote(key, url, processor)
+        finally:
+            entry = self._entries.get(key)
+            if entry:
+                entry["refreshing"] = False
+
+    def _fetch_first(self, key, url, processor):
+        """
+        Fetch a url that has no good copy yet. Only one caller goes to the
+        origin at a time (the rest wait for its result), and after a failure
+        nobody retries for retry_after seconds.
+        """
+        with self._lock:
+            if time.monotonic() < self._retry_at.get(key, 0):
+                return None
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+
+        with fetch_lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry["context"]
+            with self._lock:
+                if time.monotonic() < self._retry_at.get(key, 0):
+                    return None
+
+            entry = self._fetch_remote(key, url, processor)
+            with self._lock:
+                if entry is None:
+                    self._retry_at[key] = time.monotonic() + self.retry_after
+                else:
+                    self._retry_at.pop(key, None)
+            return entry["context"] if entry else None
+
+    def get_remote_context(self, url, processor):
+        """
+        Return the flattened context for a remote JSON endpoint.
+
+        Only the very first request for a url waits on the network (usually
+        done at startup by warm_up_contexts). After a failed first fetch, callers
+        get None without touching the origin for retry_after seconds. After that
+        a fresh copy is served from memory, and a stale one is served while a
+        background thread revalidates it (or indefinitely if the origin is down).
+
+        Args:
+            url (str): Endpoint returning the tenant JSON.
+            processor (callable): Turns the parsed JSON into the context string.
+
+        Returns:
+            str: The context, or None if no copy could ever be fetched.
+        """
+        key = ("url", url, processor)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return self._fetch_first(key, url, processor)
+
+        if time.monotonic() < entry["expires_at"]:
+            self._count("hits")
+            return entry["context"]
+
+        self._count("stale_hits")
+        with self._lock:
+            start_refresh = not entry["refreshing"]
+            entry["refreshing"] = True
+        if start_refresh:
+            self._count("background_refreshes")
+            threading.Thread(
+                target=self._refresh_in_background,
+                args=(key, url, processor),
+                daemon=True,
+            ).start()
+        return entry["context"]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["entries"] = len(self._entries)
+        return stats
+
+
+_store = ContextStore()
+
+
+def get_file_context(file_path, processor):
+    return _store.get_file_context(file_path, processor)
+
+
+def get_remote_context(url, processor):
+    return _store.get_remote_context(url, processor)
+
+
+def get_context_stats():
+    """
+    Return hit/miss counters and rebuild timings of the context cache.
+    """
+    return _store.stats()
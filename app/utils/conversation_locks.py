@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from .tracing import span
+
+# Esperas más largas que esto se registran en el log (segundos)
+SLOW_LOCK_WAIT = 5.0
+
+
+class _KeyState:
+    __slots__ = ("condition", "next_ticket", "serving")
+
+    def __init__(self, mutex):
+        self.condition = threading.Condition(mutex)
+        self.next_ticket = 0
+        self.serving = 0
+
+
+class KeyedLock:
+    """
+    One FIFO lock per key (wa_id).
+
+    Turns for the same conversation run one at a time, in the order they
+    asked for the lock, while different conversations never wait on each
+    other. Per-key state only exists while the key is held or awaited.
+    """
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._keys = {}
+        self._stats = {
+            "acquired": 0,
+            "contended": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    def acquire(self, key):
+        started = time.monotonic()
+        with self._mutex:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = _KeyState(self._mutex)
+            ticket = state.next_ticket
+            state.next_ticket += 1
+            contended = ticket != state.serving
+            while ticket != state.serving:
+                state.condition.wait()
+
+            waited = time.monotonic() - started
+            self._stats["acquired"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+            if contended:
+                self._stats["contended"] += 1
+        if waited > SLOW_LOCK_WAIT:
+            logging.warning(f"Waited {waited:.1f}s for the conversation lock of {key}")
+        return waited
+
+    def release(self, key):
+        with self._mutex:
+            state = self._keys[key]
+            state.serving += 1
+            if state.serving == state.next_ticket:
+                # Nadie más esperando: se libera el estado de la clave
+                del self._keys[key]
+            else:
+                state.condition.notify_all()
+
+    @contextmanager
+    def hold(self, key):
+        with span("conversation_lock.wait"):
+            self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def stats(self):
+        with self._mutex:
+            stats = dict(self._stats)
+            stats["active_keys"] = len(self._keys)
+            stats["waiting"] = sum(state.next_ticket - state.serving - 1 for state in self._keys.values())
+        stats["wait_time_avg"] = stats["wait_time_total"] / (stats["acquired"] or 1)
+        return stats
+
+
+_conversation_locks = KeyedLock()
+
+
+def conversation_lock(wa_id):
+    """
+    Context manager that serializes the turns of one conversation.
+    """
+    return _conversation_locks.hold(wa_id)
+
+
+def get_conversation_lock_stats():
+    return _conversation_locks.stats()
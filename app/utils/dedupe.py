@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.db_utils import get_db_connection
+
+# Cantidad de ids recientes que se recuerdan en memoria
+DEDUPE_CACHE_SIZE = int(os.getenv("DEDUPE_CACHE_SIZE", "10000"))
+# Tiempo (segundos) durante el cual un id repetido se considera duplicado
+DEDUPE_TTL = int(os.getenv("DEDUPE_TTL", "86400"))
+# Cada cuántos ids nuevos se purgan las filas vencidas de la tabla
+DEDUPE_PURGE_EVERY = int(os.getenv("DEDUPE_PURGE_EVERY", "1000"))
+
+CREATE_SEEN_TABLE = """
+    CREATE TABLE IF NOT EXISTS processed_messages (
+        message_id TEXT PRIMARY KEY,
+        seen_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+class MessageDeduplicator:
+    """
+    Remembers which WhatsApp message ids were already accepted.
+
+    A bounded in-memory LRU answers the common case (Meta retrying a few
+    seconds later) on the webhook path without touching the database. The
+    processed_messages table, whose primary key makes the claim atomic across
+    workers and restarts, is only checked by the worker that processes the
+    message. An id whose processing did not go through is released so Meta's
+    redelivery is answered.
+    """
+
+    def __init__(self, capacity=DEDUPE_CACHE_SIZE, ttl=DEDUPE_TTL, purge_every=DEDUPE_PURGE_EVERY):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._claims_since_purge = 0
+        self._stats = {"checked": 0, "duplicates": 0, "cache_hits": 0, "released": 0, "db_errors": 0}
+
+    def _remember(self, message_id, now):
+        self._recent[message_id] = now
+        self._recent.move_to_end(message_id)
+        while len(self._recent) > self.capacity:
+            self._recent.popitem(last=False)
+
+    def _claim_in_db(self, message_id):
+        """
+        Insert the id into the seen-table. Returns False if it was already there
+        and has not expired yet.
+        """
+        created_schema = False
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                if not self._schema_ready:
+                    cursor.execute(CREATE_SEEN_TABLE)
+                    created_schema = True
+                cursor.execute(
+                    """
+                    INSERT INTO processed_messages (message_id) VALUES (%s)
+                    ON CONFLICT (message_id) DO UPDATE SET seen_at = now()
+                    WHERE processed_messages.seen_at < now() - make_interval(secs => %s)
+                    RETURNING message_id
+                    """,
+                    (message_id, self.ttl),
+                )
+                claimed = cursor.fetchone() is not None
+
+                self._claims_since_purge += 1
+                if self._claims_since_purge >= self.purge_every:
+                    self._claims_since_purge = 0
+                    cursor.execute(
+                        "DELETE FROM processed_messages WHERE seen_at < now() - make_interval(secs => %s)",
+                        (self.ttl,),
+                    )
+        # Solo después del commit: si la transacción falla la tabla se vuelve a crear
+        if created_schema:
+            self._schema_ready = True
+        return claimed
+
+    def seen_recently(self, message_id):
+        """
+        Check and reserve message_id in the in-memory LRU only. Cheap enough
+        for the webhook handler.
+
+        Returns:
+            bool: True if the id was already seen within the TTL.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._stats["checked"] += 1
+            seen_at = self._recent.get(message_id)
+            if seen_at is not None and now - seen_at < self.ttl:
+                self._stats["cache_hits"] += 1
+                self._stats["duplicates"] += 1
+                return True
+            # Reservar el id para que un reintento concurrente lo vea como duplicado
+            self._remember(message_id, now)
+        return False
+
+    def claim(self, message_id):
+        """
+        Claim message_id in the processed_messages table. Called by the worker
+        before any DB or LLM work.
+
+        Returns:
+            bool: False if another worker or instance already claimed it.
+        """
+        try:
+            claimed = self._claim_in_db(message_id)
+        except Exception as e:
+            # Si la base falla preferimos procesar de más antes que perder el mensaje
+            logging.error(f"Could not record message {message_id} in processed_messages: {e}")
+            with self._lock:
+                self._stats["db_errors"] += 1
+            return True
+
+        if not claimed:
+            with self._lock:
+                self._stats["duplicates"] += 1
+        return claimed
+
+    def forget(self, message_id):
+        """
+        Drop message_id from the in-memory LRU (the event was not accepted).
+        """
+        with self._lock:
+            if self._recent.pop(message_id, None) is not None:
+                self._stats["released"] += 1
+
+    def release(self, message_id):
+        """
+        Undo claim(): drop message_id from the LRU and the table so a
+        redelivery of a message that failed is processed again.
+        """
+        self.forget(message_id)
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM processed_messages WHERE message_id = %s", (message_id,))
+        except Exception as e:
+            logging.error(f"Could not release message {message_id} from processed_messages: {e}")
+            with self._lock:
+                self._stats["db_errors"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cache_size"] = len(self._recent)
+        return stats
+
+
+_deduplicator = MessageDeduplicator()
+
+
+def is_duplicate_message(message_id):
+    """
+    In-memory check for the webhook handler; see claim_message() for the persistent one.
+    """
+    return _deduplicator.seen_recently(message_id)
+
+
+def claim_message(message_id):
+    return _deduplicator.claim(message_id)
+
+
+def forget_message(message_id):
+    _deduplicator.forget(message_id)
+
+
+def release_message(message_id):
+    _deduplicator.release(message_id)
+
+
+def get_dedupe_stats():
+    """
+    Return how many message ids were checked and how many duplicates were dropped.
+    """
+    return _deduplicator.stats()
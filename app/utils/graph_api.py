@@ -0,0 +1,111 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .tracing import span
+
+GRAPH_API_BASE_URL = "https://graph.facebook.com"
+
+
+class GraphApiClient:
+    """
+    Client for the WhatsApp Cloud (Graph) API with a pooled keep-alive session.
+
+    Credentials and URLs are resolved once from the app config when the client
+    is created, so it can be used from background workers that have no Flask
+    request context.
+    """
+
+    def __init__(self, access_token, version, phone_number_id, pool_size=10,
+                 timeout=10, connect_timeout=3):
+        self.version = version
+        self.phone_number_id = phone_number_id
+        self.timeout = (connect_timeout, timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Content-type": "application/json",
+            "Authorization": f"Bearer {access_token}",
+        })
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def messages_url(self, phone_number_id=None):
+        return f"{GRAPH_API_BASE_URL}/{self.version}/{phone_number_id or self.phone_number_id}/messages"
+
+    def post_message(self, data=None, json=None, endpoint="messages", phone_number_id=None):
+        """
+        POST to the /messages edge.
+
+        Args:
+            data (str): Pre-serialized JSON payload.
+            json (dict): Payload to serialize (alternative to data).
+            endpoint (str): Name the call is recorded under in the latency stats.
+            phone_number_id (str): Sender number; defaults to the configured one.
+
+        Returns:
+            requests.Response: The response; raises requests.RequestException
+            on network errors and HTTP error statuses.
+        """
+        started = time.monotonic()
+        failed = True
+        try:
+            with span("graph_api.post", endpoint=endpoint) as attributes:
+                response = self.session.post(
+                    self.messages_url(phone_number_id), data=data, json=json, timeout=self.timeout
+                )
+                attributes["status_code"] = response.status_code
+                response.raise_for_status()
+            failed = False
+            return response
+        finally:
+            self._record(endpoint, time.monotonic() - started, failed)
+
+    def _record(self, endpoint, elapsed, failed):
+        with self._lock:
+            stats = self._stats.setdefault(
+                endpoint, {"count": 0, "errors": 0, "latency_total": 0.0, "latency_max": 0.0}
+            )
+            stats["count"] += 1
+            stats["errors"] += int(failed)
+            stats["latency_total"] += elapsed
+            stats["latency_max"] = max(stats["latency_max"], elapsed)
+
+    def stats(self):
+        """
+        Return per-endpoint call counts, errors and latencies (seconds).
+        """
+        with self._lock:
+            stats = {endpoint: dict(values) for endpoint, values in self._stats.items()}
+        for values in stats.values():
+            values["latency_avg"] = values["latency_total"] / (values["count"] or 1)
+        return stats
+
+
+_client = None
+
+
+def init_graph_client(app):
+    """
+    Create the shared Graph API client from the app config.
+    """
+    global _client
+    _client = GraphApiClient(
+        access_token=app.config["ACCESS_TOKEN"],
+        version=app.config["VERSION"],
+        phone_number_id=app.config["PHONE_NUMBER_ID"],
+        pool_size=app.config["GRAPH_POOL_SIZE"],
+        timeout=app.config["GRAPH_TIMEOUT"],
+        connect_timeout=app.config["GRAPH_CONNECT_TIMEOUT"],
+    )
+    app.extensions["graph_api"] = _client
+    return _client
+
+
+def get_graph_client():
+    if _client is None:
+        raise RuntimeError("Graph API client not initialized; call init_graph_client(app) first.")
+    return _client
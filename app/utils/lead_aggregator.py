@@ -0,0 +1,107 @@
+import math
+import re
+import unicodedata
+
+# Dos negocios con el mismo nombre a menos de esta distancia se consideran el mismo
+LEAD_PROXIMITY_METERS = 150
+
+EARTH_RADIUS_METERS = 6371000
+
+
+def normalize_phone(phone):
+    """
+    Reduce a phone number to its last 10 digits so "+54 9 11 5723-0597",
+    "011 5723-0597" and "11 5723 0597" share a key.
+    """
+    digits = re.sub(r"\D", "", phone or "")
+    return digits[-10:] if len(digits) >= 10 else digits or None
+
+
+def normalize_name(name):
+    text = unicodedata.normalize("NFKD", name or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w\s]", " ", text.casefold())
+    return " ".join(text.split()) or None
+
+
+def _coordinates(lead):
+    coords = lead.get("coordinates") or {}
+    latitude, longitude = coords.get("latitude"), coords.get("longitude")
+    if latitude is None or longitude is None:
+        return None
+    return latitude, longitude
+
+
+def distance_meters(a, b):
+    """
+    Haversine distance between two (latitude, longitude) pairs.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(h))
+
+
+class LeadAggregator:
+    """
+    Merges the businesses returned by several search terms into unique leads.
+
+    Leads are looked up through hash indexes on the normalized phone and name,
+    so each business is merged in constant time on average. A name match only
+    counts if both leads are within `proximity_meters` of each other (or
+    neither has coordinates), which keeps branches of a chain apart.
+    Each lead records the search terms that found it in `terms`.
+    """
+
+    def __init__(self, proximity_meters=LEAD_PROXIMITY_METERS):
+        self.proximity_meters = proximity_meters
+        self.leads = []
+        self._by_phone = {}
+        self._by_name = {}
+        self.duplicates = 0
+
+    def _find(self, phone_key, name_key, coords):
+        if phone_key and phone_key in self._by_phone:
+            return self._by_phone[phone_key]
+        for lead in self._by_name.get(name_key, ()):
+            other = _coordinates(lead)
+            if coords is None and other is None:
+                return lead
+            if coords is not None and other is not None and \
+                    distance_meters(coords, other) <= self.proximity_meters:
+                return lead
+        return None
+
+    def _index(self, lead, phone_key, name_key):
+        if phone_key:
+            self._by_phone.setdefault(phone_key, lead)
+        if name_key:
+            bucket = self._by_name.setdefault(name_key, [])
+            if not any(existing is lead for existing in bucket):
+                bucket.append(lead)
+
+    def add(self, business, term):
+        """
+        Add a business found by `term`.
+
+        Returns:
+            tuple: (lead, is_new) where lead is the merged lead dict.
+        """
+        phone_key = normalize_phone(business.get("phone"))
+        name_key = normalize_name(business.get("name"))
+        coords = _coordinates(business)
+
+        lead = self._find(phone_key, name_key, coords)
+        if lead is None:
+            lead = dict(business, terms=[term])
+            self.leads.append(lead)
+            self._index(lead, phone_key, name_key)
+            return lead, True
+
+        self.duplicates += 1
+        for field, value in business.items():
+            if value and not lead.get(field):
+                lead[field] = value
+        if term not in lead["terms"]:
+            lead["terms"].append(term)
+        self._index(lead, phone_key, name_key)
+        return lead, False
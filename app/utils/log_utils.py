@@ -0,0 +1,130 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+from .tracing import current_trace_id
+
+# "json": una línea JSON por evento; "text": formato legible de siempre
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Fracción de los payloads (webhooks, respuestas, prompts) que se loguean cuando el nivel lo permite
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+# Los payloads más largos que esto se recortan
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+# Registros que esperan a ser escritos; si se llena se descartan en vez de frenar la request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Atributos propios de LogRecord; cualquier otro viene de extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, thread and message, plus
+    any fields passed with extra={...}.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without formatting them.
+
+    The stock QueueHandler runs the formatter in the calling thread; here only
+    the message arguments are merged (and tracebacks rendered, since they
+    can't cross threads), so JSON encoding and stdout writes happen on the
+    listener. The current trace id is attached so log lines can be matched
+    to spans. When the queue is full the record is dropped.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        trace_id = current_trace_id()
+        if trace_id is not None:
+            record.trace_id = trace_id
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """
+    Route the root logger through a queue to a single stdout writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+
+def _format_payload(payload):
+    text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        text = text[:LOG_PAYLOAD_MAX_CHARS] + f"... ({len(text)} chars)"
+    return text
+
+
+def log_payload(message, payload, level=logging.DEBUG, sample_rate=None, **fields):
+    """
+    Log a potentially large payload (webhook body, prompt, model reply).
+
+    Nothing is serialized unless the level is enabled and the event passes
+    sampling (LOG_PAYLOAD_SAMPLE_RATE by default), so on the hot path this
+    costs one level check.
+    """
+    logger = logging.getLogger()
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate < 1.0 and random.random() >= rate:
+        return
+    logger.log(level, f"{message}: {_format_payload(payload)}", extra=fields)
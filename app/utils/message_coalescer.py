@@ -0,0 +1,168 @@
+import atexit
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .tracing import current_trace_context, span, start_trace
+
+
+class _Burst:
+    __slots__ = ("items", "trace_contexts", "context", "first_at", "deadline")
+
+    def __init__(self, context, now):
+        self.items = []
+        self.trace_contexts = []
+        self.context = context
+        self.first_at = now
+        self.deadline = now
+
+
+class MessageCoalescer:
+    """
+    Debounces messages per key (wa_id) and hands each burst to `flush` at once.
+
+    Every message pushes the burst's deadline to `window` seconds after it,
+    capped at `max_wait` seconds after the first message, so a user typing a
+    long series of messages still gets an answer. A single scheduler thread
+    tracks the deadlines; due bursts run on a bounded pool of workers inside
+    the app context. Bursts of the same key are flushed one after another,
+    in the order they became due.
+    """
+
+    def __init__(self, app, flush, window=2.0, max_wait=10.0, workers=4):
+        self.app = app
+        self.flush = flush
+        self.window = window
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="coalesce-worker")
+        self._bursts = {}
+        self._deadlines = []
+        # Claves con una ráfaga respondiéndose -> ráfagas de esa clave que esperan su turno
+        self._flushing = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._stats = {
+            "messages": 0,
+            "bursts": 0,
+            "failed": 0,
+            "max_burst_size": 0,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="coalesce-scheduler", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logging.info(f"Message coalescing enabled with a {self.window}s window")
+
+    def stop(self, timeout=5):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        self._executor.shutdown(wait=False)
+
+    def add(self, key, item, context=None):
+        """
+        Add a message to the pending burst of `key`.
+
+        `context` is kept from the first message of the burst and passed to
+        flush(key, items, context) together with all the items, in order.
+        """
+        now = time.monotonic()
+        with self._condition:
+            burst = self._bursts.get(key)
+            if burst is None:
+                burst = self._bursts[key] = _Burst(context, now)
+            burst.items.append(item)
+            burst.trace_contexts.append(current_trace_context())
+            burst.deadline = min(now + self.window, burst.first_at + self.max_wait)
+            heapq.heappush(self._deadlines, (burst.deadline, key))
+            self._stats["messages"] += 1
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    now = time.monotonic()
+                    # Las entradas viejas del heap (deadline ya corrido) se descartan
+                    while self._deadlines:
+                        deadline, key = self._deadlines[0]
+                        burst = self._bursts.get(key)
+                        if burst is not None and burst.deadline == deadline:
+                            break
+                        heapq.heappop(self._deadlines)
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        break
+                    timeout = self._deadlines[0][0] - now if self._deadlines else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, key = heapq.heappop(self._deadlines)
+                burst = self._bursts.pop(key)
+                self._stats["bursts"] += 1
+                self._stats["max_burst_size"] = max(self._stats["max_burst_size"], len(burst.items))
+                waiting = self._flushing.get(key)
+                if waiting is not None:
+                    # Ya hay una ráfaga de esta clave en curso; esta sale cuando termine
+                    waiting.append(burst)
+                    continue
+                self._flushing[key] = deque()
+            self._executor.submit(self._flush_in_order, key, burst)
+
+    def _flush_in_order(self, key, burst):
+        while burst is not None:
+            self._flush(key, burst)
+            with self._condition:
+                waiting = self._flushing[key]
+                if waiting:
+                    burst = waiting.popleft()
+                else:
+                    del self._flushing[key]
+                    burst = None
+
+    def _flush(self, key, burst):
+        try:
+            # La respuesta se registra en la traza del último mensaje, enlazada a las demás
+            linked_traces = [trace_id for trace_id, _ in burst.trace_contexts[:-1] if trace_id]
+            with self.app.app_context(), start_trace(*burst.trace_contexts[-1]), \
+                    span("coalesced_reply", messages=len(burst.items), linked_traces=linked_traces):
+                self.flush(key, burst.items, burst.context)
+        except Exception as e:
+            with self._condition:
+                self._stats["failed"] += 1
+            logging.exception(f"Error answering coalesced messages for {key}: {e}")
+
+    def stats(self):
+        with self._condition:
+            stats = dict(self._stats)
+            stats["pending_bursts"] = len(self._bursts) + sum(len(waiting) for waiting in self._flushing.values())
+        stats["window"] = self.window
+        stats["messages_per_burst"] = stats["messages"] / (stats["bursts"] or 1)
+        return stats
+
+
+def init_message_coalescer(app, flush):
+    """
+    Start the coalescer when COALESCE_WINDOW_SECONDS > 0.
+
+    It is stored in app.extensions["message_coalescer"]; with a window of 0
+    every message is answered on its own.
+    """
+    if app.config["COALESCE_WINDOW_SECONDS"] <= 0:
+        return None
+    coalescer = MessageCoalescer(
+        app,
+        flush,
+        window=app.config["COALESCE_WINDOW_SECONDS"],
+        max_wait=app.config["COALESCE_MAX_WAIT_SECONDS"],
+        workers=app.config["WEBHOOK_WORKERS"],
+    )
+    coalescer.start()
+    app.extensions["message_coalescer"] = coalescer
+    return coalescer
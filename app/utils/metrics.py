@@ -0,0 +1,226 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, current_app
+
+from app.services.context_retrieval import get_retrieval_stats
+from app.services.prompt_builder import get_prompt_cache_stats
+from app.utils.context_store import get_context_stats
+from app.utils.conversation_locks import get_conversation_lock_stats
+from app.utils.db_utils import get_pool_stats
+from app.utils.dedupe import get_dedupe_stats
+from app.utils.search_cache import get_search_cache_stats
+from app.utils.tracing import span
+
+METRIC_PREFIX = "elbot"
+
+# Valores de los get_*_stats() que suben y bajan; el resto son contadores acumulados
+GAUGE_STATS = {"in_use", "entries", "cache_size", "active_keys", "waiting", "pending_bursts", "depth", "workers", "window", "indexes",
+               "messages_per_burst"}
+GAUGE_SUFFIXES = ("_max", "_avg", "_last", "_rate", "_size", "_entries")
+
+# Límites de los buckets de latencia (segundos): de consultas a la DB a llamadas al modelo
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+metrics_blueprint = Blueprint("metrics", __name__)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Prometheus-style histogram. An observation is a bisect plus a few
+    additions under a lock; the text format is only built when scraped.
+    """
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, [("le", _format_number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    f"{METRIC_PREFIX}_stage_duration_seconds",
+    "Latency of each stage of a conversation turn.",
+    ("stage", "tenant"),
+)
+STAGE_ERRORS = Counter(
+    f"{METRIC_PREFIX}_stage_errors_total",
+    "Stages of a conversation turn that raised an exception.",
+    ("stage", "tenant"),
+)
+TURNS = Counter(
+    f"{METRIC_PREFIX}_turns_total",
+    "Conversation turns answered, by tenant.",
+    ("tenant",),
+)
+
+_metrics = [STAGE_SECONDS, STAGE_ERRORS, TURNS]
+
+
+@contextmanager
+def observe_stage(stage, tenant):
+    """
+    Time a block as one stage of a turn: db_load, context, retrieval,
+    prompt, llm, db_store or send. The stage is also a span of the current trace.
+    """
+    started = time.perf_counter()
+    try:
+        with span(stage, tenant=tenant):
+            yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage, tenant=tenant)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage, tenant=tenant)
+
+
+def register_stats(app, name, stats_fn, label=None):
+    """
+    Publish an existing get_*_stats() function on the app's /metrics, read at
+    scrape time. Registering a name again replaces the previous function.
+
+    Numeric values become <prefix>_<name>_<key>: gauges for levels, maxima,
+    averages and rates, counters (with a _total suffix) for the accumulated
+    values. With `label`, stats_fn returns {label_value: {key: value}} and
+    label_value goes in that label.
+    """
+    app.extensions.setdefault("metrics", {})[name] = (stats_fn, label)
+
+
+def _is_gauge(key):
+    return key in GAUGE_STATS or key.endswith(GAUGE_SUFFIXES)
+
+
+def _render_stats(name, stats_fn, label):
+    try:
+        stats = stats_fn()
+    except Exception as e:
+        logging.error(f"Could not collect {name} stats: {e}")
+        return []
+    rows = stats.items() if label else [(None, stats)]
+    series = {}
+    for label_value, values in rows:
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric, metric_type = f"{METRIC_PREFIX}_{name}_{key}", "gauge"
+            if not _is_gauge(key):
+                metric_type = "counter"
+                if not metric.endswith("_total"):
+                    metric += "_total"
+            labels = _format_labels((label,), (label_value,)) if label else ""
+            series.setdefault((metric, metric_type), []).append(f"{labels} {_format_number(value)}")
+    lines = []
+    for (metric, metric_type), samples in series.items():
+        lines.append(f"# TYPE {metric} {metric_type}")
+        lines.extend(f"{metric}{sample}" for sample in samples)
+    return lines
+
+
+def render_metrics(app):
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, (stats_fn, label) in list(app.extensions.get("metrics", {}).items()):
+        lines.extend(_render_stats(name, stats_fn, label))
+    return "\n".join(lines) + "\n"
+
+
+@metrics_blueprint.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(current_app), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+def init_metrics(app):
+    """
+    Register /metrics and publish the stats of the shared components. The
+    collectors live in app.extensions["metrics"], so each app only exports
+    its own components.
+    """
+    app.register_blueprint(metrics_blueprint)
+
+    register_stats(app, "db_pool", get_pool_stats)
+    register_stats(app, "context_cache", get_context_stats)
+    register_stats(app, "retrieval", get_retrieval_stats)
+    register_stats(app, "prompt_cache", get_prompt_cache_stats)
+    register_stats(app, "conversation_lock", get_conversation_lock_stats)
+    register_stats(app, "dedupe", get_dedupe_stats)
+    register_stats(app, "search_cache", get_search_cache_stats)
+    for name, extension, label in (
+        ("webhook_queue", "webhook_queue", None),
+        ("coalescer", "message_coalescer", None),
+        ("graph_api", "graph_api", "endpoint"),
+    ):
+        component = app.extensions.get(extension)
+        if component is not None:
+            register_stats(app, name, component.stats, label)
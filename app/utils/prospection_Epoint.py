@@ -1,9 +1,13 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 import os
 import json
-import serpapi
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from app.services.llm_registry import get_chat_model
+from app.utils.search_cache import search_local_results
+from app.utils.lead_aggregator import LeadAggregator
 from langchain.schema import HumanMessage, SystemMessage
 
 # Cargar las variables de entorno desde .env
@@ -11,14 +15,28 @@ load_dotenv()
 
 prospection_blueprint = Blueprint("prospection", __name__)
 
+# Hilos compartidos por todas las búsquedas en SerpApi del proceso
+SEARCH_MAX_WORKERS = int(os.getenv("SEARCH_MAX_WORKERS", "16"))
+# Búsquedas simultáneas por request y tiempo máximo total (segundos)
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "5"))
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "45"))
+# Cada cuánto se revisa si la búsqueda fue cancelada mientras se espera (segundos)
+SEARCH_CANCEL_POLL_INTERVAL = 0.5
+
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_MAX_WORKERS, thread_name_prefix="serpapi")
+
+STREAM_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
 def setup_chat_model():
     """
-    Inicializa el modelo de chat usando LangChain con OpenAI.
+    Devuelve el modelo de chat compartido (se crea una sola vez por proceso).
     """
-    return ChatOpenAI(
-        model="gpt-4",  # Cambia a "gpt-4" si tienes acceso
+    return get_chat_model(
+        "gpt-4",  # Cambia a "gpt-4" si tienes acceso
         temperature=0.7,  # Controla la creatividad de las respuestas
-        openai_api_key=os.getenv("OPENAI_API_KEY")
     )
 
 def interpretar_json(chat_model, json_data):
@@ -58,7 +76,7 @@ def interpretar_json(chat_model, json_data):
         return cleaned_terms
 
     except Exception as e:
-        print(f"Error al interpretar el JSON con el modelo: {e}")
+        logging.error(f"Error al interpretar el JSON con el modelo: {e}")
         return []
 
 def search_google_maps(term, location="Buenos Aires"):
@@ -67,27 +85,15 @@ def search_google_maps(term, location="Buenos Aires"):
     if not api_key:
         raise ValueError("La API key de SerpApi no está configurada.")
     
-    # Crear cliente de SerpApi
-    client = serpapi.Client(api_key=api_key)
-
-    # Configurar los parámetros de búsqueda
-    params = {
-        "engine": "google_maps",
-        "q": term,
-        "location": location,
-        "type": "search",
-        "hl": "es",
-    }
-
-    # Realizar la búsqueda
+    # Realizar la búsqueda (o tomarla del caché si ya se hizo)
     try:
-        results = client.search(**params)
+        local_results = search_local_results(api_key, term, location, hl="es")
     except Exception as e:
-        print(f"Error al realizar la búsqueda: {e}")
+        logging.error(f"Error al realizar la búsqueda: {e}")
         return []
 
     businesses = []
-    for result in results.get("local_results", []):
+    for result in local_results:
         business = {
             "name": result.get("title"),
             "phone": result.get("phone"),
@@ -100,11 +106,126 @@ def search_google_maps(term, location="Buenos Aires"):
     return businesses
 
 
+def iter_search_results(terms, location="Buenos Aires", max_concurrency=SEARCH_CONCURRENCY,
+                        deadline=SEARCH_DEADLINE, cancel_event=None):
+    """
+    Busca todos los términos en paralelo y devuelve los resultados a medida que llegan.
+
+    Como mucho `max_concurrency` búsquedas de esta request están en curso a la
+    vez. Cuando se cumple `deadline` se dejan de esperar las que faltan. Si se
+    activa `cancel_event` (o el consumidor deja de iterar) no se lanzan más
+    búsquedas y se cancelan las que todavía no empezaron.
+
+    Parámetros:
+        terms (list): Términos de búsqueda.
+        location (str): Ubicación para Google Maps.
+        max_concurrency (int): Búsquedas simultáneas para esta request.
+        deadline (float): Segundos máximos para toda la búsqueda.
+        cancel_event (threading.Event): Cancela la búsqueda cuando se activa.
+
+    Retorna:
+        generator: Tuplas (término, resultados) en orden de llegada. Los términos
+        que no terminaron a tiempo se devuelven al final con resultados None;
+        al cancelar no se devuelve nada más.
+    """
+    pending = list(terms)
+    in_flight = {}
+    expires_at = time.monotonic() + deadline
+
+    try:
+        while pending or in_flight:
+            if cancel_event is not None and cancel_event.is_set():
+                logging.info(f"Search cancelled; {len(in_flight) + len(pending)} terms not searched")
+                return
+            while pending and len(in_flight) < max_concurrency:
+                term = pending.pop(0)
+                in_flight[_search_executor.submit(search_google_maps, term, location)] = term
+
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                break
+            # Espera en tramos cortos para notar la cancelación sin esperar a la próxima búsqueda
+            if cancel_event is not None:
+                remaining = min(remaining, SEARCH_CANCEL_POLL_INTERVAL)
+            done, _ = wait(in_flight, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                term = in_flight.pop(future)
+                yield term, future.result()
+
+        timed_out = list(in_flight.values()) + pending
+        if timed_out:
+            logging.warning(f"Search deadline of {deadline}s reached; {len(timed_out)} terms timed out: {timed_out}")
+        for term in timed_out:
+            yield term, None
+    finally:
+        # También al cancelar o si el consumidor deja de iterar (GeneratorExit)
+        for future in in_flight:
+            future.cancel()
+
+
+def format_stream_event(event, data, stream_format):
+    payload = json.dumps(data, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+
+def stream_leads(search_terms, stream_format):
+    """
+    Genera los eventos de una búsqueda en streaming (NDJSON o SSE).
+
+    Cada lead se emite apenas termina el primer término que lo encuentra
+    ("lead", con un id correlativo); si otro término vuelve a encontrarlo se
+    emite solo un "match" con ese id. Los términos que no terminan a tiempo
+    generan "timeout" y al final se envía un resumen "done".
+    """
+    aggregator = LeadAggregator()
+    lead_ids = {}
+    timed_out = []
+
+    yield format_stream_event("terms", {"terms": search_terms}, stream_format)
+    for term, results in iter_search_results(search_terms):
+        if results is None:
+            timed_out.append(term)
+            yield format_stream_event("timeout", {"term": term}, stream_format)
+            continue
+        for business in results:
+            lead, is_new = aggregator.add(business, term)
+            if is_new:
+                lead_ids[id(lead)] = len(lead_ids)
+                yield format_stream_event("lead", {"id": lead_ids[id(lead)], "lead": lead}, stream_format)
+            else:
+                yield format_stream_event("match", {"id": lead_ids[id(lead)], "term": term}, stream_format)
+
+    yield format_stream_event(
+        "done",
+        {"leads": len(lead_ids), "duplicates": aggregator.duplicates, "timed_out": timed_out},
+        stream_format,
+    )
+
+
+def requested_stream_format():
+    """
+    Formato de streaming pedido por el cliente: ?stream=ndjson|sse o el header Accept.
+    """
+    stream_format = request.args.get("stream")
+    if stream_format in STREAM_MIMETYPES:
+        return stream_format
+    accept = request.headers.get("Accept", "")
+    for stream_format, mimetype in STREAM_MIMETYPES.items():
+        if mimetype in accept:
+            return stream_format
+    return None
+
+
 @prospection_blueprint.route("/prospectar", methods=["POST"])
 def process_json():
     """
     Endpoint que recibe un JSON en el cuerpo de la solicitud POST,
     genera términos de búsqueda y devuelve los resultados consolidados en una lista plana.
+
+    Con ?stream=ndjson o ?stream=sse (o Accept: application/x-ndjson /
+    text/event-stream) los leads se envían a medida que cada término termina.
     """
     try:
         # Cargar datos del JSON proporcionado en el POST
@@ -119,25 +240,26 @@ def process_json():
         # Generar términos de búsqueda usando el modelo
         search_terms = interpretar_json(chat_model, json_data)
 
-        # Consolidar todos los resultados en una lista plana
-        all_results = []
-        for term in search_terms:
-            print(f"\nBuscando: {term} en Google Maps...")
-            results = search_google_maps(term)
-            all_results.extend(results)  # Agregar resultados directamente a la lista plana
-
-            if results:
-                print(f"Resultados encontrados para '{term}':")
-                for business in results:
-                    coords = business.get("coordinates", {})
-                    email = business.get("email", "No disponible")
-                    print(f"- Nombre: {business['name']}, Teléfono: {business['phone']}, Coordenadas: {coords}, Correo: {email}")
-            else:
-                print(f"No se encontraron resultados para '{term}'.")
+        stream_format = requested_stream_format()
+        if stream_format:
+            return Response(
+                stream_leads(search_terms, stream_format),
+                mimetype=STREAM_MIMETYPES[stream_format],
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        # Consolidar todos los resultados en una lista plana, sin negocios repetidos
+        aggregator = LeadAggregator()
+        for term, results in iter_search_results(search_terms):
+            if results is None:
+                logging.warning(f"La búsqueda de '{term}' no terminó a tiempo.")
+                continue
+            for business in results:
+                aggregator.add(business, term)
+            logging.debug(f"{len(results)} resultados para '{term}'.")
 
-        # Mostrar el JSON consolidado con todos los resultados
-        print("\nLista consolidada con todos los resultados:")
-        print(json.dumps(all_results, indent=4, ensure_ascii=False))
+        all_results = aggregator.leads
+        logging.info(f"{len(all_results)} leads únicos ({aggregator.duplicates} duplicados combinados).")
 
         # Devolver la lista consolidada como respuesta del endpoint
         return jsonify(all_results), 200
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Blueprint, jsonify, request, send_file
+
+from .lead_aggregator import LeadAggregator
+from .prospection_Epoint import interpretar_json, iter_search_results, setup_chat_model
+
+# Trabajos de prospección que corren a la vez
+PROSPECTION_JOB_WORKERS = int(os.getenv("PROSPECTION_JOB_WORKERS", "2"))
+# Tiempo máximo para las búsquedas de un trabajo (segundos)
+PROSPECTION_JOB_DEADLINE = float(os.getenv("PROSPECTION_JOB_DEADLINE", "600"))
+# Carpeta donde se guardan los resultados de cada trabajo
+PROSPECTION_JOBS_DIR = os.getenv("PROSPECTION_JOBS_DIR", "prospection_jobs")
+# Trabajos terminados que se mantienen en memoria (el resto queda solo en disco)
+PROSPECTION_JOBS_IN_MEMORY = int(os.getenv("PROSPECTION_JOBS_IN_MEMORY", "100"))
+
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+prospection_jobs_blueprint = Blueprint("prospection_jobs", __name__)
+
+
+class ProspectionJob:
+    def __init__(self, json_data):
+        self.id = uuid.uuid4().hex
+        self.json_data = json_data
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.terms = []
+        self.completed_terms = []
+        self.timed_out_terms = []
+        self.aggregator = LeadAggregator()
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def to_dict(self, include_results=True):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": {
+                "terms_total": len(self.terms),
+                "terms_completed": len(self.completed_terms),
+                "terms_timed_out": len(self.timed_out_terms),
+                "leads": len(self.aggregator.leads),
+            },
+            "terms": self.terms,
+            "timed_out_terms": self.timed_out_terms,
+            "error": self.error,
+        }
+        if include_results:
+            # Copia bajo lock: el worker puede estar combinando leads mientras tanto
+            with self.lock:
+                data["results"] = [dict(lead, terms=list(lead["terms"])) for lead in self.aggregator.leads]
+        return data
+
+
+class ProspectionJobManager:
+    """
+    Runs prospecting jobs on a bounded worker pool.
+
+    Each job generates the search terms with the model, searches them through
+    iter_search_results and merges the leads as they arrive, so progress and
+    partial results can be polled while it runs. Finished jobs are written to
+    PROSPECTION_JOBS_DIR and can still be read after a restart.
+    """
+
+    def __init__(self, workers=PROSPECTION_JOB_WORKERS, jobs_dir=PROSPECTION_JOBS_DIR,
+                 deadline=PROSPECTION_JOB_DEADLINE, max_in_memory=PROSPECTION_JOBS_IN_MEMORY):
+        self.jobs_dir = jobs_dir
+        self.deadline = deadline
+        self.max_in_memory = max_in_memory
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prospection-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, json_data):
+        job = ProspectionJob(json_data)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict_finished()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return job
+        job.cancel_event.set()
+        if job.status == "queued":
+            # Todavía no arrancó: el worker lo va a descartar al tomarlo
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        return job
+
+    def result_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def load_result(self, job_id):
+        try:
+            with open(self.result_path(job_id), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _evict_finished(self):
+        finished = [job for job in self._jobs.values() if job.status in FINISHED_STATUSES]
+        for job in finished[:max(0, len(finished) - self.max_in_memory)]:
+            del self._jobs[job.id]
+
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            self._save(job)
+            return
+
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.terms = interpretar_json(setup_chat_model(), job.json_data)
+            for term, results in iter_search_results(job.terms, deadline=self.deadline, cancel_event=job.cancel_event):
+                if job.cancel_event.is_set():
+                    break
+                if results is None:
+                    job.timed_out_terms.append(term)
+                    continue
+                with job.lock:
+                    for business in results:
+                        job.aggregator.add(business, term)
+                job.completed_terms.append(term)
+            job.status = "cancelled" if job.cancel_event.is_set() else "completed"
+        except Exception as e:
+            logging.exception(f"Prospection job {job.id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+
+    def _save(self, job):
+        try:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            tmp_path = self.result_path(job.id) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(job.to_dict(), file, ensure_ascii=False)
+            os.replace(tmp_path, self.result_path(job.id))
+        except OSError as e:
+            logging.error(f"Could not save results of prospection job {job.id}: {e}")
+
+
+job_manager = ProspectionJobManager()
+
+
+def _job_not_found():
+    return jsonify({"error": "Trabajo no encontrado"}), 404
+
+
+@prospection_jobs_blueprint.route("/prospectar/jobs", methods=["POST"])
+def submit_job():
+    """
+    Crea un trabajo de prospección en segundo plano y devuelve su id.
+    """
+    json_data = request.get_json(silent=True)
+    if not json_data:
+        return jsonify({"error": "No se proporcionó un JSON válido"}), 400
+
+    job = job_manager.submit(json_data)
+    return jsonify({"job_id": job.id, "status": job.status}), 202
+
+
+@prospection_jobs_blueprint.route("/prospectar/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """
+    Estado, progreso y resultados (parciales o finales) de un trabajo.
+    Con ?results=0 se omite la lista de leads.
+    """
+    if not JOB_ID_PATTERN.match(job_id):
+        return _job_not_found()
+    include_results = request.args.get("results", "1") != "0"
+
+    job = job_manager.get(job_id)
+    if job is not None:
+        return jsonify(job.to_dict(include_results=include_results)), 200
+
+    saved = job_manager.load_result(job_id)
+    if saved is None:
+        return _job_not_found()
+    if not include_results:
+        saved.pop("results", None)
+    return jsonify(saved), 200
+
+
+@prospection_jobs_blueprint.route("/prospectar/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """
+    Cancela un trabajo en curso; los leads encontrados hasta ese momento se conservan.
+    """
+    if not JOB_ID_PATTERN.match(job_id):
+        return _job_not_found()
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return _job_not_found()
+    return jsonify({"job_id": job.id, "status": job.status}), 200
+
+
+@prospection_jobs_blueprint.route("/prospectar/jobs/<job_id>/download", methods=["GET"])
+def download_job(job_id):
+    """
+    Descarga el archivo JSON con los resultados de un trabajo terminado.
+    """
+    if not JOB_ID_PATTERN.match(job_id):
+        return _job_not_found()
+    path = job_manager.result_path(job_id)
+    if not os.path.exists(path):
+        job = job_manager.get(job_id)
+        if job is not None:
+            return jsonify({"error": "El trabajo todavía no terminó", "status": job.status}), 409
+        return _job_not_found()
+    return send_file(
+        os.path.abspath(path),
+        mimetype="application/json",
+        as_attachment=True,
+        download_name=f"prospeccion_{job_id}.json",
+    )
@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import serpapi
+
+# Archivo SQLite compartido por el blueprint de prospección y prospect.py
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.sqlite3")
+# Vigencia de una búsqueda cacheada (segundos); por defecto 7 días
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(7 * 24 * 3600)))
+# Máximo de búsquedas guardadas; se descartan las menos usadas recientemente
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "5000"))
+
+CREATE_CACHE_TABLE = """
+    CREATE TABLE IF NOT EXISTS search_cache (
+        key TEXT PRIMARY KEY,
+        results TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    )
+"""
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.casefold().split())
+
+
+def cache_key(term, location, hl):
+    return "\x1f".join(normalize_text(part) for part in (term, location, hl))
+
+
+class SearchCache:
+    """
+    Persistent SQLite cache of Google Maps search results.
+
+    Keys are the normalized (term, location, hl), so "Imprentas " and
+    "imprentas" share an entry. Entries expire after `ttl` seconds and the
+    table is kept under `max_entries` by evicting the least recently used rows.
+    """
+
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0}
+
+    def _connection(self):
+        # Una conexión por hilo; WAL permite leer mientras otro hilo escribe
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(CREATE_CACHE_TABLE)
+            conn.execute("CREATE INDEX IF NOT EXISTS search_cache_last_access ON search_cache (last_access)")
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def get(self, term, location, hl="es"):
+        """
+        Return the cached results, or None on a miss or expired entry.
+        """
+        key = cache_key(term, location, hl)
+        conn = self._connection()
+        row = conn.execute("SELECT results, created_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.ttl:
+            self._count("misses")
+            if row is not None:
+                self._count("expired")
+            return None
+
+        conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+        conn.commit()
+        self._count("hits")
+        return json.loads(row[0])
+
+    def set(self, term, location, hl, results):
+        key = cache_key(term, location, hl)
+        now = time.time()
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO search_cache (key, results, created_at, last_access) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(results, ensure_ascii=False), now, now),
+        )
+        evicted = conn.execute(
+            """
+            DELETE FROM search_cache WHERE key IN (
+                SELECT key FROM search_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        ).rowcount
+        conn.commit()
+        self._count("stores")
+        if evicted:
+            self._count("evictions", evicted)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["entries"] = self._connection().execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+        return stats
+
+
+_cache = SearchCache()
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(api_key):
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = serpapi.Client(api_key=api_key)
+            _clients[api_key] = client
+        return client
+
+
+def search_local_results(api_key, term, location, hl="es"):
+    """
+    Return the Google Maps `local_results` for a search, served from the cache when possible.
+
+    Only successful SerpApi responses are cached; errors propagate to the caller.
+
+    Args:
+        api_key (str): SerpApi key.
+        term (str): Search term.
+        location (str): Location for the search.
+        hl (str): Results language.
+
+    Returns:
+        list: Raw SerpApi `local_results` entries.
+    """
+    cached = _cache.get(term, location, hl)
+    if cached is not None:
+        return cached
+
+    params = {
+        "engine": "google_maps",
+        "q": term,
+        "location": location,
+        "type": "search",
+        "hl": hl,
+    }
+    results = _get_client(api_key).search(**params)
+    local_results = results.get("local_results", [])
+    try:
+        _cache.set(term, location, hl, local_results)
+    except sqlite3.Error as e:
+        logging.error(f"Could not store search for '{term}' in the cache: {e}")
+    return local_results
+
+
+def get_search_cache_stats():
+    """
+    Return hit/miss counters, hit rate and size of the search cache.
+    """
+    return _cache.stats()
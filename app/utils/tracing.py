@@ -0,0 +1,207 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from flask import Blueprint, abort, jsonify, request
+
+# Spans recientes que se guardan en memoria para /debug/traces
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "5000"))
+# Archivo JSONL donde se escribe cada span (vacío = solo memoria)
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# Token para /debug/traces (header X-Debug-Token); sin token solo responde a localhost
+TRACE_DEBUG_TOKEN = os.getenv("TRACE_DEBUG_TOKEN", "")
+
+tracing_blueprint = Blueprint("tracing", __name__)
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span_id = contextvars.ContextVar("span_id", default=None)
+
+
+class SpanRecorder:
+    """
+    Keeps the last `buffer_size` finished spans in a ring buffer and, if
+    `path` is set, appends them as JSON lines from a background thread.
+    """
+
+    def __init__(self, buffer_size=TRACE_BUFFER_SIZE, path=TRACE_FILE):
+        self._spans = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self.path = path
+        self._queue = None
+        if path:
+            self._queue = queue.SimpleQueue()
+            threading.Thread(target=self._write, name="trace-writer", daemon=True).start()
+            atexit.register(self._queue.put, None)
+
+    def record(self, span):
+        with self._lock:
+            self._spans.append(span)
+        if self._queue is not None:
+            self._queue.put(span)
+
+    def _write(self):
+        with open(self.path, "a", encoding="utf-8") as file:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    return
+                try:
+                    file.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+                    if self._queue.empty():
+                        file.flush()
+                except (OSError, ValueError) as e:
+                    logging.error(f"Could not write trace span: {e}")
+
+    def get_trace(self, trace_id):
+        with self._lock:
+            spans = [span for span in self._spans if span["trace_id"] == trace_id]
+        return sorted(spans, key=lambda span: span["start"])
+
+    def recent_traces(self, limit=50):
+        """
+        Summary of the most recent traces: root span, duration and span count.
+        """
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span["start"])
+        traces = {}
+        for span in spans:
+            trace = traces.setdefault(span["trace_id"], {
+                "trace_id": span["trace_id"], "start": span["start"], "end": 0.0, "spans": 0, "root": None, "errors": 0,
+            })
+            trace["start"] = min(trace["start"], span["start"])
+            trace["end"] = max(trace["end"], span["start"] + span["duration"])
+            trace["spans"] += 1
+            trace["errors"] += int(span["status"] == "error")
+            if span["parent_id"] is None and trace["root"] is None:
+                trace["root"] = span["name"]
+        recent = sorted(traces.values(), key=lambda trace: trace["start"], reverse=True)[:limit]
+        for trace in recent:
+            trace["duration"] = trace.pop("end") - trace["start"]
+        return recent
+
+
+_recorder = SpanRecorder()
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def current_trace_context():
+    """
+    (trace_id, span_id) to hand over to another thread with start_trace(*context).
+    """
+    return _trace_id.get(), _span_id.get()
+
+
+@contextmanager
+def start_trace(trace_id=None, parent_id=None):
+    """
+    Make `trace_id` (or a new one) the current trace for the block. Used where
+    work enters the app (webhook, web chat) and, with the parent span, where
+    it changes thread (webhook queue, coalescer).
+    """
+    trace_token = _trace_id.set(trace_id or new_trace_id())
+    span_token = _span_id.set(parent_id)
+    try:
+        yield _trace_id.get()
+    finally:
+        _span_id.reset(span_token)
+        _trace_id.reset(trace_token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time the block as a span of the current trace. Outside a trace it does
+    nothing. Attributes set on the yielded dict are recorded with the span.
+    """
+    trace_id = _trace_id.get()
+    if trace_id is None:
+        yield attributes
+        return
+
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _span_id.get()
+    token = _span_id.set(span_id)
+    start = time.time()
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield attributes
+    except Exception as e:
+        status = "error"
+        attributes["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _span_id.reset(token)
+        _recorder.record({
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "start": start,
+            "duration": duration,
+            "status": status,
+            "thread": threading.current_thread().name,
+            "attributes": attributes,
+        })
+
+
+def traced(name=None):
+    """
+    Decorator: run the function inside a span named after it.
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _check_debug_access():
+    if TRACE_DEBUG_TOKEN:
+        if request.headers.get("X-Debug-Token") != TRACE_DEBUG_TOKEN:
+            abort(403)
+    elif request.remote_addr not in ("127.0.0.1", "::1"):
+        abort(403)
+
+
+@tracing_blueprint.route("/debug/traces", methods=["GET"])
+def list_traces():
+    """
+    Trazas más recientes (?limit=N, por defecto 50).
+    """
+    _check_debug_access()
+    limit = request.args.get("limit", 50, type=int)
+    return jsonify({"traces": _recorder.recent_traces(limit)}), 200
+
+
+@tracing_blueprint.route("/debug/traces/<trace_id>", methods=["GET"])
+def get_trace(trace_id):
+    """
+    Todos los spans de una traza, en orden de inicio.
+    """
+    _check_debug_access()
+    spans = _recorder.get_trace(trace_id)
+    if not spans:
+        return jsonify({"error": "Traza no encontrada"}), 404
+    return jsonify({"trace_id": trace_id, "spans": spans}), 200
@@ -0,0 +1,132 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from .tracing import current_trace_context, span, start_trace
+from .whatsapp_utils import process_whatsapp_message
+
+
+class WebhookQueue:
+    """
+    Bounded in-process queues of webhook events drained by a fixed pool of workers.
+
+    The webhook handler only enqueues the event and returns, so Meta gets its 200
+    right away; the read receipt, DB work, LLM call and reply happen on a worker
+    thread inside the app context. Each worker has its own queue and events
+    are routed by key (the sender's wa_id), so the messages of one
+    conversation are processed by one worker in arrival order.
+    """
+
+    def __init__(self, app, workers=4, maxsize=1000):
+        self.app = app
+        self.workers = workers
+        shards = max(1, workers)
+        self._queues = [queue.Queue(maxsize=max(1, maxsize // shards)) for _ in range(shards)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "rejected": 0,
+            "processed": 0,
+            "failed": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "processing_time_total": 0.0,
+            "processing_time_max": 0.0,
+        }
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(self._queues[i],), name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.stop)
+        logging.info(f"Webhook queue started with {self.workers} workers")
+
+    def stop(self, timeout=5):
+        for work_queue in self._queues[:len(self._threads)]:
+            try:
+                work_queue.put_nowait(None)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def enqueue(self, body, key=None):
+        """
+        Queue a webhook body for processing. Bodies with the same key always
+        go to the same worker, in the order they were enqueued.
+
+        Returns:
+            bool: False if the queue is full and the event was not accepted.
+        """
+        work_queue = self._queues[hash(key) % len(self._queues)]
+        try:
+            work_queue.put_nowait((body, time.monotonic(), current_trace_context()))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+        return True
+
+    def _run(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                return
+            body, enqueued_at, trace_context = item
+            started = time.monotonic()
+            failed = False
+            try:
+                with self.app.app_context(), start_trace(*trace_context), \
+                        span("webhook_queue.process", queue_wait=started - enqueued_at):
+                    process_whatsapp_message(body)
+            except Exception as e:
+                failed = True
+                logging.exception(f"Error processing queued webhook event: {e}")
+            finally:
+                work_queue.task_done()
+                self._record(started - enqueued_at, time.monotonic() - started, failed)
+
+    def _record(self, waited, elapsed, failed):
+        with self._lock:
+            self._stats["failed" if failed else "processed"] += 1
+            self._stats["queue_wait_total"] += waited
+            self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], waited)
+            self._stats["processing_time_total"] += elapsed
+            self._stats["processing_time_max"] = max(self._stats["processing_time_max"], elapsed)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        done = (stats["processed"] + stats["failed"]) or 1
+        stats["depth"] = sum(work_queue.qsize() for work_queue in self._queues)
+        stats["workers"] = self.workers
+        stats["queue_wait_avg"] = stats["queue_wait_total"] / done
+        stats["processing_time_avg"] = stats["processing_time_total"] / done
+        return stats
+
+
+def init_webhook_queue(app):
+    """
+    Start the webhook worker pool when WEBHOOK_MODE is "queue".
+
+    The queue is stored in app.extensions["webhook_queue"]; with any other mode
+    nothing is started and webhooks are processed inline.
+    """
+    if app.config["WEBHOOK_MODE"] != "queue":
+        return None
+    webhook_queue = WebhookQueue(
+        app,
+        workers=app.config["WEBHOOK_WORKERS"],
+        maxsize=app.config["WEBHOOK_QUEUE_SIZE"],
+    )
+    webhook_queue.start()
+    app.extensions["webhook_queue"] = webhook_queue
+    return webhook_queue
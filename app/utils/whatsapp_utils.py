@@ -2,19 +2,20 @@ import logging
 from flask import current_app, jsonify
 import json
 import requests
-import importlib
-#from app.services.langchain_service import generate_response
+from .dedupe import claim_message, release_message
+from .graph_api import get_graph_client
+from .log_utils import log_payload
+from .metrics import observe_stage
+from .tracing import traced
+from app.services.conversation_engine import generate_response
+from app.services.tenants import get_tenant_for_phone
 import re
 
-PHONE_NUMBER_TO_MODULE = {
-    "5491151465950": "app.services.langchain_jelko",
-    "5491136148233": "app.services.langchain_jelko",
-}
-
 def log_http_response(response):
-    logging.info(f"Status: {response.status_code}")
-    logging.info(f"Content-type: {response.headers.get('content-type')}")
-    logging.info(f"Body: {response.text}")
+    logging.debug(f"Status: {response.status_code}")
+    # El body solo se lee y se loguea con LOG_LEVEL=DEBUG
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        log_payload(f"Graph API response ({response.headers.get('content-type')})", response.text)
 
 
 def get_text_message_input(recipient, text):
@@ -29,17 +30,25 @@ def get_text_message_input(recipient, text):
     )
 
 
-def send_message(data):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
+def get_template_message_input(recipient, template_name, language_code="es", components=None):
+    data = {
+        "messaging_product": "whatsapp",
+        "to": recipient,
+        "type": "template",
+        "template": {
+            "name": template_name,
+            "language": {"code": language_code}
+        }
     }
+    if components:
+        data["template"]["components"] = components
+    return data
 
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
 
+@traced()
+def send_message(data):
     try:
-        response = requests.post(url, data=data, headers=headers, timeout=10)
-        response.raise_for_status()
+        response = get_graph_client().post_message(data=data, endpoint="send_message")
     except requests.Timeout:
         logging.error("Timeout occurred while sending message")
         return jsonify({"status": "error", "message": "Request timed out"}), 408
@@ -55,13 +64,6 @@ def send_read_receipt(message_id, wa_id):
     """
     Sends a read receipt to WhatsApp indicating the message has been read.
     """
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
-
     # Payload for marking the message as read
     data = json.dumps(
         {
@@ -73,8 +75,7 @@ def send_read_receipt(message_id, wa_id):
     )
 
     try:
-        response = requests.post(url, data=data, headers=headers, timeout=10)
-        response.raise_for_status()
+        response = get_graph_client().post_message(data=data, endpoint="read_receipt")
     except requests.Timeout:
         logging.error("Timeout occurred while sending read receipt")
     except requests.RequestException as e:
@@ -97,27 +98,15 @@ def process_text_for_whatsapp(text):
 
 
 
+@traced()
 def process_whatsapp_message(body):
     # Obtener el número del destinatario
     phone_number = body["entry"][0]["changes"][0]["value"]["metadata"]["display_phone_number"]
 
-    # Buscar el módulo correspondiente al número de teléfono
-    module_name = PHONE_NUMBER_TO_MODULE.get(phone_number)
-    if not module_name:
-        logging.error(f"No module found for phone number: {phone_number}")
-        return
-
-    # Cargar dinámicamente el módulo
-    try:
-        company_module = importlib.import_module(module_name)
-    except ModuleNotFoundError:
-        logging.error(f"Module {module_name} not found for phone number: {phone_number}")
-        return
-
-    # Obtener la función generate_response del módulo
-    generate_response = getattr(company_module, "generate_response", None)
-    if not callable(generate_response):
-        logging.error(f"Function 'generate_response' not found in module {module_name}")
+    # Buscar el tenant correspondiente al número de teléfono
+    tenant = get_tenant_for_phone(phone_number)
+    if tenant is None:
+        logging.error(f"No tenant found for phone number: {phone_number}")
         return
 
     # Extraer datos del mensaje
@@ -126,23 +115,78 @@ def process_whatsapp_message(body):
     message_data = body["entry"][0]["changes"][0]["value"]["messages"][0]
     message_id = message_data["id"]  # ID del mensaje
 
-    # Enviar recibo de lectura
-    send_read_receipt(message_id, wa_id)
+    # Reclamo persistente del id (entre workers e instancias) antes de tocar la DB o el modelo
+    if not claim_message(message_id):
+        logging.info(f"Duplicate message {message_id} ignored.")
+        return
+
+    try:
+        # Enviar recibo de lectura
+        send_read_receipt(message_id, wa_id)
+
+        # Verificar si el mensaje es de audio
+        if message_data["type"] == "audio":
+            response_text = "Hola! Si podes haceme el favor de escribirme, no puedo escuchar audios."
+            with observe_stage("send", tenant.name):
+                send_message(get_text_message_input(wa_id, response_text))
+            return
 
-    # Verificar si el mensaje es de audio
-    if message_data["type"] == "audio":
-        response_text = "Hola! Si podes haceme el favor de escribirme, no puedo escuchar audios."
-    else:
-        # Generar la respuesta normal
         message = message_data["text"]["body"]
-        response_text = generate_response(message, wa_id, name)
+
+        # Los mensajes seguidos del mismo usuario se juntan y se responden con una sola llamada al modelo
+        coalescer = current_app.extensions.get("message_coalescer")
+        if coalescer is not None:
+            # El id viaja con el mensaje para poder liberarlo si la respuesta de la ráfaga falla
+            coalescer.add((tenant.name, wa_id), (message_id, message), context=(tenant, name))
+            return
+
+        if not reply_to_messages(tenant, wa_id, name, [message]):
+            release_message(message_id)
+    except Exception:
+        # Si el mensaje no se pudo responder, su reenvío tiene que procesarse
+        release_message(message_id)
+        raise
+
+
+def reply_to_messages(tenant, wa_id, name, messages):
+    """
+    Generate one reply for one or more user messages and send it.
+
+    Returns:
+        bool: False if no reply could be generated (nothing is sent).
+    """
+    response_text = generate_response(tenant, messages, wa_id, name)
+    if response_text is None:
+        logging.error(f"No reply generated for {wa_id}; nothing sent.")
+        return False
 
     # Enviar la respuesta
     data = get_text_message_input(wa_id, response_text)
-    send_message(data)
+    with observe_stage("send", tenant.name):
+        send_message(data)
+    return True
 
 
+def reply_to_burst(key, items, context):
+    """
+    Flush callback for the message coalescer: answers a whole burst at once.
 
+    items are (message_id, text) pairs. If the reply fails, every id of the
+    burst is released so Meta's redeliveries are answered.
+    """
+    tenant, name = context
+    _, wa_id = key
+    message_ids = [message_id for message_id, _ in items]
+    messages = [message for _, message in items]
+    if len(messages) > 1:
+        logging.info(f"Answering {len(messages)} coalesced messages from {wa_id} with one reply")
+    replied = False
+    try:
+        replied = reply_to_messages(tenant, wa_id, name, messages)
+    finally:
+        if not replied:
+            for message_id in message_ids:
+                release_message(message_id)
 
 
 def is_valid_whatsapp_message(body):
@@ -160,14 +204,6 @@ def is_valid_whatsapp_message(body):
 
 
 
-import requests
-import logging
-from flask import current_app
-
-import requests
-import logging
-from flask import current_app
-
 def send_template_message(recipient, template_name, language_code="es", components=None):
     """
     Send a proactive WhatsApp message using a pre-approved template.
@@ -178,45 +214,25 @@ def send_template_message(recipient, template_name, language_code="es", componen
         language_code (str): The language code of the template (default is 'es').
         components (list): Components for the template placeholders (default is None).
     """
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
-
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
+    # Solo agregar "components" si se proporciona correctamente
+    if components and not isinstance(components, list):  # Verifica que sea una lista
+        logging.error("'components' no es una lista de objetos JSON válida.")
+        return None  # No continuar si hay un error en los components
 
     # Payload para el mensaje de plantilla
-    data = {
-        "messaging_product": "whatsapp",
-        "to": recipient,
-        "type": "template",
-        "template": {
-            "name": template_name,
-            "language": {"code": language_code}
-        }
-    }
-    
-    # Solo agregar "components" si se proporciona correctamente
-    if components:
-        if isinstance(components, list):  # Verifica que sea una lista
-            data["template"]["components"] = components
-        else:
-            print("⚠️ Error: 'components' no es una lista de objetos JSON válida.")
-            return None  # No continuar si hay un error en los components
+    data = get_template_message_input(recipient, template_name, language_code, components)
 
-    print(f"Payload corregido: {data}")  # Imprime el JSON antes de enviarlo
+    log_payload("Template payload", data)
 
     try:
-        response = requests.post(url, json=data, headers=headers, timeout=10)
-        print(f"Respuesta HTTP: {response.status_code}, {response.text}")  # Imprime la respuesta exacta
-        response.raise_for_status()
+        response = get_graph_client().post_message(json=data, endpoint="send_template")
+        log_http_response(response)
         logging.info(f"Template message sent to {recipient}.")
         return response.json()
     except requests.RequestException as e:
         logging.error(f"Failed to send template message to {recipient}: {e}")
-        print(f"Error enviando mensaje: {e}")  # Muestra el error en consola
-        if response is not None:
-            print(f"Respuesta de WhatsApp: {response.text}")  # Muestra detalles del error si hay respuesta
+        if e.response is not None:
+            logging.error(f"Respuesta de WhatsApp: {e.response.text}")
         return None
 
 
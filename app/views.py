@@ -1,9 +1,12 @@
 import logging
 import json
-from .utils.whatsapp_utils import send_template_message
+from .utils.bulk_sender import send_template_bulk
 from flask import Blueprint, request, jsonify, current_app
 
 from .decorators.security import signature_required
+from .utils.dedupe import forget_message, is_duplicate_message
+from .utils.log_utils import log_payload
+from .utils.tracing import span, start_trace
 from .utils.whatsapp_utils import (
     process_whatsapp_message,
     is_valid_whatsapp_message,
@@ -34,8 +37,8 @@ def handle_message():
     """
     body = request.get_json()
 
-    # Imprimir el JSON completo del cuerpo de la solicitud
-    logging.info(f"Received payload: {json.dumps(body, indent=2)}")
+    # El payload completo solo se serializa con LOG_LEVEL=DEBUG (y según el muestreo)
+    log_payload("Received payload", body)
 
     # Check if it's a WhatsApp status update
     if (
@@ -44,7 +47,7 @@ def handle_message():
         .get("value", {})
         .get("statuses")
     ):
-        logging.info("Received a WhatsApp status update.")
+        logging.debug("Received a WhatsApp status update.")
         return jsonify({"status": "ok"}), 200
 
     try:
@@ -58,7 +61,29 @@ def handle_message():
                 logging.warning("Message timestamp exceeds one hour. Ignoring message.")
                 return jsonify({"status": "ignored", "message": "Message too old."}), 200
 
-            process_whatsapp_message(body)
+            # Meta redelivers messages it thinks timed out; answer each id only once.
+            # Here only the in-memory check runs; the worker claims the id in the DB.
+            if is_duplicate_message(message["id"]):
+                logging.info(f"Duplicate message {message['id']} ignored.")
+                return jsonify({"status": "ignored", "message": "Duplicate message."}), 200
+
+            webhook_queue = current_app.extensions.get("webhook_queue")
+            if webhook_queue is None:
+                try:
+                    process_whatsapp_message(body)
+                except Exception as e:
+                    forget_message(message["id"])
+                    logging.exception(f"Error processing message {message['id']}: {e}")
+                    return jsonify({"status": "error", "message": "Processing failed"}), 500
+                return jsonify({"status": "ok"}), 200
+
+            # Acknowledge right away; a worker sends the reply. Routing by wa_id keeps
+            # the order of arrival for each conversation (same worker, FIFO).
+            if not webhook_queue.enqueue(body, key=message.get("from")):
+                # Sin liberar el id, el reenvío de Meta se descartaría como duplicado
+                forget_message(message["id"])
+                logging.error("Webhook queue is full. Rejecting message so it gets redelivered.")
+                return jsonify({"status": "error", "message": "Queue full"}), 503
             return jsonify({"status": "ok"}), 200
         else:
             # If the request is not a WhatsApp API event, return an error
@@ -121,7 +146,9 @@ def webhook_get():
 @webhook_blueprint.route("/webhooks", methods=["POST"])
 @signature_required
 def webhook_post():
-    return handle_message()
+    # Cada webhook abre una traza; su id viaja con el evento por la cola y los workers
+    with start_trace(), span("webhook_post"):
+        return handle_message()
 
 
 @send_template_blueprint.route("/send-messages", methods=["POST"])
@@ -153,12 +180,23 @@ def send_messages():
         if not recipients:
             return jsonify({"status": "error", "message": "No valid phone numbers provided"}), 400
 
-        # Enviar mensajes a cada número
-        for recipient in recipients:
-            logging.info(f"Sending template message to {recipient}.")
-            send_template_message(recipient, template_name, components=components)
-
-        return jsonify({"status": "success", "message": f"Messages sent to {len(recipients)} recipients"}), 200
+        # Enviar los mensajes en paralelo, respetando el límite de envío por número
+        logging.info(f"Sending template message to {len(recipients)} recipients.")
+        results = send_template_bulk(
+            recipients,
+            template_name,
+            components=components,
+            rate=current_app.config["BULK_SEND_RATE"],
+            concurrency=current_app.config["BULK_SEND_CONCURRENCY"],
+            max_retries=current_app.config["BULK_SEND_MAX_RETRIES"],
+        )
+        sent = sum(1 for result in results if result["status"] == "sent")
+
+        return jsonify({
+            "status": "success" if sent == len(results) else "partial",
+            "message": f"Messages sent to {sent} of {len(recipients)} recipients",
+            "results": results,
+        }), 200
 
     except Exception as e:
         logging.error(f"Error processing request: {e}")
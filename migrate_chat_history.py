@@ -0,0 +1,81 @@
+import argparse
+import json
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from app.utils.db_utils import DB_URL
+from app.utils.chat_store import CREATE_MESSAGES_TABLE
+
+
+def iter_blobs(conn, batch_size):
+    # Cursor con nombre (server-side) para no cargar toda la tabla en memoria
+    with conn.cursor(name="chat_history_blobs") as cursor:
+        cursor.itersize = batch_size
+        cursor.execute("SELECT wa_id, history FROM chat_history ORDER BY wa_id")
+        for wa_id, history in cursor:
+            yield wa_id, history
+
+
+def blob_to_rows(wa_id, history):
+    if history is None:
+        return []
+    messages = json.loads(history) if isinstance(history, str) else history
+    return [
+        (wa_id, seq, msg.get("role", "user"), msg.get("content", ""))
+        for seq, msg in enumerate(messages, start=1)
+    ]
+
+
+def migrate_chat_history(batch_size=500, dry_run=False):
+    """
+    Copy every chat_history blob into chat_messages, one row per message.
+
+    Conversations that already have rows in chat_messages are skipped, so the
+    migration can be re-run safely. chat_history itself is left untouched.
+    """
+    read_conn = psycopg2.connect(DB_URL)
+    write_conn = psycopg2.connect(DB_URL)
+    migrated_threads = 0
+    migrated_messages = 0
+    skipped = 0
+    try:
+        with write_conn.cursor() as cursor:
+            cursor.execute(CREATE_MESSAGES_TABLE)
+        write_conn.commit()
+
+        for wa_id, history in iter_blobs(read_conn, batch_size):
+            rows = blob_to_rows(wa_id, history)
+            if not rows:
+                continue
+
+            with write_conn.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM chat_messages WHERE wa_id = %s LIMIT 1", (wa_id,))
+                if cursor.fetchone():
+                    skipped += 1
+                    continue
+                if not dry_run:
+                    execute_values(
+                        cursor,
+                        "INSERT INTO chat_messages (wa_id, seq, role, content) VALUES %s "
+                        "ON CONFLICT (wa_id, seq) DO NOTHING",
+                        rows,
+                    )
+            write_conn.commit()
+            migrated_threads += 1
+            migrated_messages += len(rows)
+
+        action = "Would migrate" if dry_run else "Migrated"
+        print(f"{action} {migrated_messages} messages from {migrated_threads} threads "
+              f"({skipped} threads already migrated).")
+    finally:
+        read_conn.close()
+        write_conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate chat_history blobs to the per-message chat_messages table.")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows fetched per round-trip from chat_history.")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be migrated without writing.")
+    args = parser.parse_args()
+    migrate_chat_history(batch_size=args.batch_size, dry_run=args.dry_run)
@@ -1,9 +1,9 @@
 import os
 import json
-import serpapi
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
+from app.utils.search_cache import search_local_results
 
 # Cargar las variables de entorno desde .env
 load_dotenv()
@@ -71,27 +71,15 @@ def search_google_maps(term, location="Buenos Aires"):
     if not api_key:
         raise ValueError("La API key de SerpApi no está configurada.")
     
-    # Crear cliente de SerpApi
-    client = serpapi.Client(api_key=api_key)
-
-    # Configurar los parámetros de búsqueda
-    params = {
-        "engine": "google_maps",
-        "q": term,
-        "location": location,
-        "type": "search",
-        "hl": "es",
-    }
-
-    # Realizar la búsqueda
+    # Realizar la búsqueda (o tomarla del caché si ya se hizo)
     try:
-        results = client.search(**params)
+        local_results = search_local_results(api_key, term, location, hl="es")
     except Exception as e:
         print(f"Error al realizar la búsqueda: {e}")
         return []
 
     businesses = []
-    for result in results.get("local_results", []):
+    for result in local_results:
         business = {
             "name": result.get("title"),
             "phone": result.get("phone"),